@@ -0,0 +1,380 @@
+"""Benchmarks of the TVIM compiler on synthetic manuscripts.
+
+Генерирует статьи в формате журнала (abstractX/abstractXr, \\authorInfo,
+разделы, список литературы, рисунки) заданного объема и замеряет время
+Article.parse, Article.compile, TvimDocument._build и ref_corr.corr, а
+также время импорта модулей (python -X importtime).
+По умолчанию LaTeX не нужен; с --latex дополнительно замеряется полная
+сборка выпуска.
+
+Результаты сохраняются в JSON файл. Если передать результаты предыдущего
+запуска через --baseline, замедления больше порога считаются регрессиями.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import ref_corr
+import tvim
+
+
+# минимальный PNG файл 1x1
+PNG_STUB = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae'
+    '426082')
+
+WORDS = ('пусть', 'функция', 'оператор', 'пространство', 'непрерывна',
+         'ограничен', 'тогда', 'существует', 'решение', 'задачи', 'Коши',
+         'теорема', 'доказательство', 'следует', 'из', 'леммы', 'и')
+
+FAMILIES = ('Иванов', 'Петров', 'Сидоров', 'Кузнецов', 'Смирнов', 'Попов',
+            'Васильев', 'Соколов', 'Михайлов', 'Новиков', 'Федоров')
+
+
+def paragraph(rnd, nwords=80):
+    words = [rnd.choice(WORDS) for _ in range(nwords)]
+    return ' '.join(words) + ' $f(x) = \\int_0^x g(t)\\,dt$.'
+
+
+def bibitem(rnd, key):
+    family = rnd.choice(FAMILIES)
+    return '\\medskip\n\\bibitem{{{key}}}\n' \
+           '\\tvimRefArticleEn{{{family},\\;A.\\;B.}}{{{year}}}' \
+           '{{On some problem {key}}}{{Journal of Mathematics}}' \
+           '{{{vol}}}{{}}{{{p0}-{p1}}}\n'.format(
+                key=key, family=family, year=rnd.randint(1950, 2020),
+                vol=rnd.randint(1, 90), p0=rnd.randint(1, 100),
+                p1=rnd.randint(101, 200))
+
+
+def make_article(index, size=30000, sections=5, bibitems=20, figures=2,
+                 seed=0):
+    """
+    Сгенерировать исходный текст статьи объемом примерно size символов.
+
+    Returns
+    -------
+        tuple
+            Текст статьи и список имен файлов рисунков
+    """
+    rnd = random.Random(seed * 100003 + index)
+    family = FAMILIES[index % len(FAMILIES)] + str(index)
+    head = [
+        '\\markboth{{{{\\footnotesize{{\\it \\textbf{{А.\\;Б.\\;{f}}}}}}}}}'
+        '{{{{\\footnotesize {{\\it \\textbf{{Синтетическая статья}}}}}}}}'
+        .format(f=family),
+        '',
+        '\\noindent {\\bf \\footnotesize УДК: 517.9}',
+        '\\noindent {\\bf \\footnotesize MSC2010: 35P}',
+        '',
+        '\\title{{Синтетическая статья {}}}'.format(index),
+        '',
+        '\\author{{А.\\;Б.\\;{}}}'.format(family),
+        '',
+        '\\begin{abstractXr}',
+        '{Синтетическая статья}',
+        '{{{}\\;А.\\;Б.}}'.format(family),
+        paragraph(rnd),
+        '\\end{abstractXr}',
+        '\\keywordsr{синтетика, тест}',
+        '',
+        '\\begin{{abstractX}}{{Synthetic article {}}}'
+        '{{Author{}\\;A.\\;B.}}'.format(index, index),
+        paragraph(rnd),
+        '\\end{abstractX}',
+        '\\keywords{synthetic, benchmark}',
+        '',
+    ]
+    figure_names = ['fig{}.png'.format(i) for i in range(figures)]
+    refs = ['ref{}'.format(i) for i in range(bibitems)]
+
+    sections = max(sections, 1)
+    head_size = sum(len(line) + 1 for line in head)
+    bib = ['\\begin{thebibliography}{99}'] + \
+        [bibitem(rnd, key) for key in refs] + ['\\end{thebibliography}']
+    bib_size = sum(len(line) + 1 for line in bib)
+    section_size = max((size - head_size - bib_size) // sections, 0)
+
+    body = []
+    for i in range(sections):
+        body.append('\\section{{Раздел {}}}'.format(i + 1))
+        body.append('\\label{{sec{}}}'.format(i))
+        written = 0
+        while written < section_size:
+            text = paragraph(rnd)
+            if refs:
+                text += ' См. \\cite{{{}}}.'.format(rnd.choice(refs))
+            body.append(text + '\n')
+            written += len(text) + 2
+        if i < len(figure_names):
+            body.append('\\begin{{figure}}[h]\n\\centering\n'
+                        '\\includegraphics[width=5cm]{{{}}}\n'
+                        '\\end{{figure}}'.format(figure_names[i]))
+    # оставшиеся рисунки в последний раздел
+    for name in figure_names[sections:]:
+        body.append('\\includegraphics[width=5cm]{{{}}}'.format(name))
+
+    info = '\\authorInfo{{{}}}{{Андрей Борисович}}{{профессор}}' \
+           '{{a{}@example.com}}\n\n'.format(family, index)
+    text = '\n'.join(head + body + bib) + '\n\n' + info
+    return text, figure_names
+
+
+def make_issue(path, articles=10, size=30000, sections=5, bibitems=20,
+               figures=2, seed=0):
+    """
+    Сгенерировать каталог статей выпуска.
+    """
+    os.makedirs(path, exist_ok=True)
+    for i in range(articles):
+        art_path = os.path.join(path, 'art{:03d}'.format(i))
+        os.makedirs(art_path, exist_ok=True)
+        text, figure_names = make_article(i, size, sections, bibitems,
+                                          figures, seed)
+        with open(os.path.join(art_path, 'main.tex'), 'wt') as f:
+            f.write(text)
+        for name in figure_names:
+            with open(os.path.join(art_path, name), 'wb') as f:
+                f.write(PNG_STUB)
+
+
+def _config(articles_path, resources_path):
+    return {
+        'tvim': {'year': 2000, 'number': 1, 'total number': 1},
+        'path': {'articles': articles_path, 'resources': resources_path,
+                 'docs': 'docs', 'output': 'output'},
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Подавить вывод компилятора (списки разделов, предупреждения) во время
+    замеров.
+    """
+    with open(os.devnull, 'wt') as devnull:
+        with contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            yield
+
+
+def measure(func, repeat):
+    """
+    Минимальное время выполнения func из repeat запусков.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_article(workdir, size, args):
+    """
+    Время Article.parse, Article.compile и ref_corr.corr для одной статьи
+    объемом size символов.
+    """
+    articles_path = os.path.join(workdir, 'articles')
+    make_issue(articles_path, 1, size, args.sections, args.bibitems,
+               args.figures, args.seed)
+    art_path = os.path.join('articles', 'art000')
+    results = {}
+
+    with quiet():
+        results['Article.parse'] = measure(
+            lambda: tvim.Article(art_path, root=workdir).parse(),
+            args.repeat)
+        results['Article.compile'] = measure(
+            lambda: tvim.Article(art_path, root=workdir).compile(),
+            args.repeat)
+    article = tvim.Article(art_path, root=workdir)
+    bib = article.text[article.text.find('\\begin{thebibliography}'):]
+    results['ref_corr.corr'] = measure(lambda: ref_corr.corr(bib),
+                                       args.repeat)
+    return results
+
+
+def bench_issue(workdir, articles, args):
+    """
+    Время TvimDocument._build (и, с --latex, полной сборки) для выпуска из
+    articles статей.
+    """
+    articles_path = os.path.join(workdir, 'articles')
+    make_issue(articles_path, articles, args.size, args.sections,
+               args.bibitems, args.figures, args.seed)
+    resources_path = os.path.abspath(args.resources)
+    results = {}
+
+    def build():
+        doc = tvim.TvimDocument(_config(articles_path, resources_path),
+                                jobs=args.jobs, use_cache=False)
+        # статьи уже лежат в workdir/articles, как в рабочем каталоге
+        doc.root_path = workdir
+        doc._build()
+
+    with quiet():
+        results['TvimDocument._build'] = measure(build, args.repeat)
+
+    if args.latex:
+        def compile_issue():
+            doc = tvim.TvimDocument(_config(articles_path, resources_path),
+                                    jobs=args.jobs, use_cache=False)
+            doc.root_path = os.path.join(workdir, 'numbers', 'tvim_2000_1')
+            doc.compile()
+        results['TvimDocument.compile'] = measure(compile_issue, 1)
+    return results
+
+
+def bench_import(module, repeat):
+    """
+    Время импорта модуля в новом интерпретаторе по данным
+    `python -X importtime` (накопленное время модуля верхнего уровня).
+    """
+    best = None
+    for _ in range(repeat):
+        res = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import {}'.format(module)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        for line in res.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module \
+                    and not fields[2].startswith('  '):
+                elapsed = int(fields[1]) / 1e6
+                best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    factor = 1
+    if value.endswith('k'):
+        factor, value = 1000, value[:-1]
+    elif value.endswith('m'):
+        factor, value = 1000 ** 2, value[:-1]
+    return int(float(value) * factor)
+
+
+def compare(results, baseline, threshold):
+    """
+    Сравнить результаты с предыдущим запуском.
+
+    Returns
+    -------
+        list
+            Регрессии: (название, параметр, было, стало)
+    """
+    old = {(r['bench'], r['param']): r['seconds'] for r in baseline}
+    regressions = []
+    for r in results:
+        before = old.get((r['bench'], r['param']))
+        if before and r['seconds'] > before * (1 + threshold):
+            regressions.append((r['bench'], r['param'], before,
+                                r['seconds']))
+    return regressions
+
+
+def run(args):
+    results = []
+    print('{:<24} {:>16} {:>12}'.format('benchmark', 'param', 'seconds'))
+
+    def add(bench, param, seconds):
+        results.append({'bench': bench, 'param': param, 'seconds': seconds})
+        print('{:<24} {:>16} {:>12.4f}'.format(bench, param, seconds))
+
+    for module in args.imports:
+        add('import', 'module={}'.format(module),
+            bench_import(module, args.repeat))
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix='tvim_bench_') as workdir:
+            for bench, seconds in bench_article(workdir, size, args).items():
+                add(bench, 'size={}'.format(size), seconds)
+
+    for articles in args.articles:
+        with tempfile.TemporaryDirectory(prefix='tvim_bench_') as workdir:
+            for bench, seconds in bench_issue(workdir, articles,
+                                              args).items():
+                add(bench, 'articles={}'.format(articles), seconds)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TVIM compiler benchmarks')
+    parser.add_argument('--sizes', type=str, default='10k,100k,1m,5m',
+                        help='comma separated article sizes for the '
+                             'per-article benchmarks')
+    parser.add_argument('--articles', type=str, default='1,10,50,200',
+                        help='comma separated article counts for the '
+                             '_build benchmarks')
+    parser.add_argument('--imports', type=str, default='tvim,ref_corr',
+                        help='comma separated modules for the startup '
+                             '(python -X importtime) benchmarks')
+    parser.add_argument('--size', type=str, default='30k',
+                        help='article size for the _build benchmarks')
+    parser.add_argument('--sections', type=int, default=5)
+    parser.add_argument('--bibitems', type=int, default=20)
+    parser.add_argument('--figures', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='repeat each measurement and keep the best')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='processes used by TvimDocument._build')
+    parser.add_argument('--resources', type=str, default='resources',
+                        help='journal resources directory')
+    parser.add_argument('--latex', action='store_true',
+                        help='also time full issue compilation (pdflatex)')
+    parser.add_argument('--output', '-O', type=str, default=None,
+                        help='results file (default: '
+                             'bench_results/<timestamp>.json)')
+    parser.add_argument('--baseline', '-B', type=str, default=None,
+                        help='previous results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown treated as a regression')
+    parser.add_argument('--generate', type=str, default=None,
+                        help='only generate a synthetic articles directory')
+    _args = parser.parse_args()
+    _args.sizes = [parse_size(v) for v in _args.sizes.split(',') if v]
+    _args.articles = [int(v) for v in _args.articles.split(',') if v]
+    _args.imports = [v for v in _args.imports.split(',') if v]
+    _args.size = parse_size(_args.size)
+
+    if _args.generate:
+        make_issue(_args.generate, max(_args.articles), _args.size,
+                   _args.sections, _args.bibitems, _args.figures,
+                   _args.seed)
+        sys.exit(0)
+
+    _results = run(_args)
+    _output = _args.output or os.path.join(
+        'bench_results',
+        datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(_output) or '.', exist_ok=True)
+    with open(_output, 'wt') as file:
+        json.dump({'version': tvim.__version__,
+                   'date': datetime.datetime.now().isoformat(),
+                   'results': _results}, file, indent=4)
+    print('Results saved to {}'.format(_output))
+
+    if _args.baseline:
+        with open(_args.baseline, 'rt') as file:
+            _baseline = json.load(file)['results']
+        _regressions = compare(_results, _baseline, _args.threshold)
+        for _bench, _param, _before, _after in _regressions:
+            print('REGRESSION {} {}: {:.4f} -> {:.4f} s'.format(
+                _bench, _param, _before, _after))
+        if _regressions:
+            sys.exit(1)
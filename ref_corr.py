@@ -1,22 +1,36 @@
 """References correction script."""
+import os
 import re
-import argparse
+import sys
 
 
-def ref_corr(text):
+def _upper_surname(match):
+    return match.group(1).upper() + r', ' + match.group(2).upper() + r'.'
 
-    def upper_surname(match):
-        return match.group(1).upper() + r', ' + match.group(2).upper() + r'.'
 
-    text = re.sub(r'(\d+)\s*-+\s*(\d+)', r'\1--\2', text, 0, re.IGNORECASE)
+# правила применяются по очереди, каждое к результату предыдущего
+RULES = (
+    (re.compile(r'(\d+)\s*-+\s*(\d+)', re.IGNORECASE), r'\1--\2'),
     # English
-    text = re.sub(r'(P.)\s+(\d+)', r'P.\;\2', text, 0, re.IGNORECASE)
-    text = re.sub(r'(\d+)\s+(p.?)', r'\1\;p.', text, 0, re.IGNORECASE)
-    text = re.sub(r'([a-zA-Z]+)[,\\;\s]+([A-Z]{1}[a-z]?)\.{1}', upper_surname,
-                  text)
+    (re.compile(r'(P.)\s+(\d+)', re.IGNORECASE), r'P.\;\2'),
+    (re.compile(r'(\d+)\s+(p.?)', re.IGNORECASE), r'\1\;p.'),
+    (re.compile(r'([a-zA-Z]+)[,\\;\s]+([A-Z]{1}[a-z]?)\.{1}'), _upper_surname),
     # Russian
-    text = re.sub(r'(С.)\s+(\d+)', r'С.\;\2', text, 0, re.IGNORECASE)
-    text = re.sub(r'(\d+)\s+(с.?)', r'\1\;с.', text, 0, re.IGNORECASE)
+    (re.compile(r'(С.)\s+(\d+)', re.IGNORECASE), r'С.\;\2'),
+    (re.compile(r'(\d+)\s+(с.?)', re.IGNORECASE), r'\1\;с.'),
+)
+
+# Строка, с которой может начинаться очередная часть текста при потоковой
+# обработке: команда с маленькой буквы, например, \bibitem. Ни одно правило
+# не может совпасть с текстом, содержащим перевод строки и следующие за ним
+# `\` и маленькую букву (кроме p, см. правило `P.`), поэтому части можно
+# исправлять независимо.
+_chunk_start_re = re.compile(r'\\[a-oq-z]')
+
+
+def ref_corr(text):
+    for pattern, repl in RULES:
+        text = pattern.sub(repl, text)
     return text
 
 
@@ -25,21 +39,112 @@ def corr(text):
     return text
 
 
+def iter_chunks(lines, chunk_size=1 << 20):
+    """
+    Разбить текст (итератор строк) на части не меньше chunk_size символов,
+    которые можно исправлять независимо (см. _chunk_start_re).
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        if size >= chunk_size and _chunk_start_re.match(line):
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _open(path, mode):
+    if path == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        # закрывать стандартные потоки не нужно
+        return open(stream.fileno(), mode, closefd=False,
+                    encoding=stream.encoding)
+    return open(path, mode)
+
+
+def corr_stream(src, dst, chunk_size=1 << 20, executor=None, jobs=1):
+    """
+    Исправить текст из потока src и записать в поток dst по частям.
+    Результат совпадает с corr(src.read()).
+
+    Если задан executor (пул процессов), одновременно исправляются до
+    2 * jobs частей; части записываются в исходном порядке.
+    """
+    chunks = iter_chunks(src, chunk_size)
+    if executor is None:
+        for chunk in chunks:
+            dst.write(corr(chunk))
+        return
+    import collections
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(executor.submit(corr, chunk))
+        if len(pending) >= 2 * jobs:
+            dst.write(pending.popleft().result())
+    while pending:
+        dst.write(pending.popleft().result())
+
+
+def corr_file(task):
+    """
+    Исправить файл input_path и записать результат в output_path
+    ('-' - стандартный ввод или вывод).
+    """
+    input_path, output_path, chunk_size = task
+    with _open(input_path, 'rt') as src, _open(output_path, 'wt') as dst:
+        corr_stream(src, dst, chunk_size)
+    return output_path
+
+
 if __name__ == '__main__':
+    import argparse
+
     parser = argparse.ArgumentParser(description='TVIM reference corrector')
 
     input_path = parser.add_argument('--input', '-I', type=str,
-                                     default='tmp/i_corr.txt',
-                                     help='input file')
+                                     action='append',
+                                     help='input file, "-" for stdin; may be '
+                                          'repeated (default: '
+                                          'tmp/i_corr.txt)')
     output_path = parser.add_argument('--output', '-O', type=str,
-                                      default='tmp/o_corr.txt',
-                                      help='output file')
+                                      default=None,
+                                      help='output file, "-" for stdout, or '
+                                           'a directory when several inputs '
+                                           'are given (default: '
+                                           'tmp/o_corr.txt)')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='number of processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=1 << 20,
+                        help='minimum chunk size in characters')
     _args = parser.parse_args()
 
-    with open(_args.input, 'rt') as file:
-        _text = file.read()
-
-    _text = corr(_text)
-
-    with open(_args.output, 'wt') as file:
-        file.write(_text)
+    _inputs = _args.input or ['tmp/i_corr.txt']
+    _jobs = _args.jobs or os.cpu_count() or 1
+    if len(_inputs) == 1:
+        _output = _args.output or 'tmp/o_corr.txt'
+        if _jobs > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(_jobs) as _executor, \
+                    _open(_inputs[0], 'rt') as _src, \
+                    _open(_output, 'wt') as _dst:
+                corr_stream(_src, _dst, _args.chunk_size, _executor, _jobs)
+        else:
+            corr_file((_inputs[0], _output, _args.chunk_size))
+    else:
+        if '-' in _inputs or not _args.output or _args.output == '-':
+            parser.error('several inputs require --output directory and '
+                         'cannot include stdin')
+        os.makedirs(_args.output, exist_ok=True)
+        _tasks = [(path, os.path.join(_args.output, os.path.basename(path)),
+                   _args.chunk_size) for path in _inputs]
+        if len(set(task[1] for task in _tasks)) < len(_tasks):
+            parser.error('input files must have different names')
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(
+                min(_jobs, len(_tasks))) as _executor:
+            for _path in _executor.map(corr_file, _tasks):
+                print(_path, file=sys.stderr)
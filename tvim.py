@@ -1,15 +1,30 @@
-import argparse
-import yaml
+import bisect
+import collections
+import contextlib
+import cProfile
+import functools
+import glob
+import hashlib
+import io
 import shutil
 import os
 import subprocess
+import sys
 import re
+import tempfile
+import threading
+import time
 import logging
-import PyPDF2
-from docx import Document
 import json
-from transliterate import translit
 
+# Тяжелые зависимости (PyPDF2, docx, yaml, transliterate) и
+# concurrent.futures импортируются при первом использовании: для разбора
+# метаданных статей они не нужны, а docx нужен только для --report.
+# Pillow необязателен: без него большие растровые изображения не
+# уменьшаются (см. FigureCache).
+
+
+__version__ = '1.1.0'
 
 logger = logging.getLogger('tvim')
 logger.setLevel(logging.INFO)
@@ -31,23 +46,264 @@ def get_text_between_braces(text, open_pos=0):
         i += 1
 
 
+# команда LaTeX: имя без обратной косой черты, позиция начала команды,
+# позиция сразу после имени (и звездочки) и признак звездочки
+LatexToken = collections.namedtuple('LatexToken',
+                                    ['name', 'start', 'end', 'star'])
+
+# окружение LaTeX: позиция \begin, начало и конец содержимого,
+# позиция сразу после \end{name}
+LatexEnvironment = collections.namedtuple(
+    'LatexEnvironment',
+    ['name', 'start', 'content_start', 'content_end', 'end'])
+
+# элемент списка литературы: ключ \bibitem, необязательная метка [label],
+# позиция \bibitem и конец элемента в исходном тексте статьи, текст элемента
+BibItem = collections.namedtuple('BibItem',
+                                 ['key', 'label', 'start', 'end', 'text'])
+
+
+class LatexScanner:
+    """
+    Однопроходный сканер исходного текста статьи.
+
+    Текст просматривается один раз, при этом запоминаются позиции всех команд,
+    окружений и меток УДК/MSC2010. Методы извлечения данных статьи получают
+    нужные позиции из словарей и читают аргументы команд с учетом
+    вложенных фигурных скобок.
+    """
+    _token_re = re.compile(r'\\(?:(?P<name>[A-Za-z@]+)(?P<star>\*?)|.)'
+                           r'|(?P<marker>УДК|MSC2010):', flags=re.DOTALL)
+    _brace_re = re.compile(r'\\.|[{}]', flags=re.DOTALL)
+    _space_re = re.compile(r'\s*')
+
+    def __init__(self, text):
+        self.text = text or ''
+        self.tokens = collections.defaultdict(list)
+        self.environments = collections.defaultdict(list)
+        self.markers = collections.defaultdict(list)
+        self._scan()
+
+    def _scan(self):
+        text = self.text
+        opened = collections.defaultdict(list)
+        for m in self._token_re.finditer(text):
+            if m['marker']:
+                self.markers[m['marker']].append(m.end())
+                continue
+            name = m['name']
+            if not name:
+                continue
+            token = LatexToken(name, m.start(), m.end(), bool(m['star']))
+            self.tokens[name].append(token)
+            if name in ('begin', 'end'):
+                arg = self.argument(token.end)
+                if arg is None:
+                    continue
+                env_name, _, arg_end = arg
+                if name == 'begin':
+                    opened[env_name].append((token.start, arg_end))
+                elif opened[env_name]:
+                    start, content_start = opened[env_name].pop()
+                    self.environments[env_name].append(
+                        LatexEnvironment(env_name, start, content_start,
+                                         token.start, arg_end))
+        for envs in self.environments.values():
+            envs.sort(key=lambda e: e.start)
+
+    def commands(self, name):
+        """
+        Все вхождения команды в порядке следования в тексте.
+        """
+        return self.tokens.get(name, [])
+
+    def first(self, name):
+        """
+        Первое вхождение команды или None.
+        """
+        tokens = self.tokens.get(name)
+        return tokens[0] if tokens else None
+
+    def environment(self, name):
+        """
+        Первое вхождение окружения или None.
+        """
+        envs = self.environments.get(name)
+        return envs[0] if envs else None
+
+    def match_brace(self, open_pos):
+        """
+        Позиция сразу после фигурной скобки, закрывающей скобку в позиции
+        open_pos, или None, если скобки не сбалансированы.
+        """
+        depth = 0
+        for m in self._brace_re.finditer(self.text, open_pos):
+            ch = m.group()
+            if ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    return m.end()
+        return None
+
+    def argument(self, pos, skip_space=False):
+        """
+        Аргумент в фигурных скобках, начинающийся в позиции pos.
+
+        Returns
+        -------
+            tuple или None
+                Текст аргумента без скобок, позиция открывающей скобки и
+                позиция сразу после закрывающей скобки
+        """
+        if skip_space:
+            pos = self._space_re.match(self.text, pos).end()
+        if not self.text.startswith('{', pos):
+            return None
+        end = self.match_brace(pos)
+        if end is None:
+            return None
+        return self.text[pos + 1:end - 1], pos, end
+
+    def arguments(self, pos, count, skip_space=False):
+        """
+        Несколько подряд идущих аргументов в фигурных скобках.
+        """
+        args = []
+        for _ in range(count):
+            arg = self.argument(pos, skip_space)
+            if arg is None:
+                break
+            args.append(arg)
+            pos = arg[2]
+        return args
+
+
+class TextPatcher:
+    """
+    Набор правок фрагмента текста, заданных позициями в исходной строке.
+
+    Правки (замены и вставки) накапливаются без копирования текста и
+    применяются за один проход методом apply. Правки не должны пересекаться.
+    """
+
+    def __init__(self, text, start=0, end=None):
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+        # (начало, конец, порядковый номер, замена), упорядочены по позиции
+        self._patches = []
+
+    def _neighbours(self, start, end):
+        i = bisect.bisect_left(self._patches, (start, end, -1))
+        return self._patches[max(i - 1, 0):i + 1], i
+
+    def overlaps(self, start, end):
+        """
+        Пересекается ли интервал [start, end) с уже добавленными правками.
+        """
+        patches, _ = self._neighbours(start, end)
+        return any(p[0] < end and start < p[1] for p in patches)
+
+    def replace(self, start, end, replacement):
+        """
+        Заменить текст в интервале [start, end).
+        """
+        if self.overlaps(start, end):
+            raise ValueError('Правка [{}, {}) пересекается с другой правкой'
+                             .format(start, end))
+        _, i = self._neighbours(start, end)
+        # вставки в одной позиции применяются в порядке добавления
+        while i < len(self._patches) and self._patches[i][:2] == (start, end):
+            i += 1
+        self._patches.insert(i, (start, end, len(self._patches), replacement))
+
+    def insert(self, pos, text):
+        """
+        Вставить текст в позицию pos.
+        """
+        self.replace(pos, pos, text)
+
+    def apply(self):
+        """
+        Текст фрагмента с примененными правками.
+        """
+        parts = []
+        pos = self.start
+        for start, end, _, replacement in self._patches:
+            parts.append(self.text[pos:start])
+            parts.append(replacement)
+            pos = end
+        parts.append(self.text[pos:self.end])
+        return ''.join(parts)
+
+
 class ArticleBase:
+    """
+    Статья в рабочем каталоге выпуска.
 
-    def __init__(self, path):
+    path - путь к каталогу статьи относительно рабочего каталога root (по
+    умолчанию текущего каталога на момент создания статьи); он используется
+    в TeX файлах выпуска (\\input, пути к изображениям). Файлы статьи
+    читаются и записываются по абсолютным путям (full_path, art_path),
+    поэтому текущий каталог процесса после создания статьи не важен.
+    """
+
+    def __init__(self, path, root=None):
         self._path = path
+        self._root = os.path.abspath(root or os.curdir)
         self.text = self.get_text()
         self.article_text = ''
 
     path = property(lambda self: self._path)
-    art_path = property(lambda self: os.path.join(self.path, '__article.tex'))
+    root = property(lambda self: self._root)
+    full_path = property(lambda self: os.path.join(self._root, self._path))
+    art_path = property(lambda self: os.path.join(self.full_path,
+                                                  '__article.tex'))
+    tex_path = property(lambda self: os.path.join(self.path, '__article.tex'))
 
     def compile(self):
         pass
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # сканер легко восстановить по тексту, передавать его между
+        # процессами и сохранять в кэш не нужно
+        state.pop('_scanner', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def check(self):
+        """
+        Проверить исходный текст статьи без компиляции.
+
+        Returns
+        -------
+            list
+                Замечания: словари с ключами level ('error' или 'warning'),
+                line (номер строки или None) и message
+        """
+        if self.text is None:
+            return [{'level': 'error', 'line': None,
+                     'message': 'В каталоге статьи нет .tex файла'}]
+        problems = []
+        for pos in Article._check_balance_of_parantheses(self.text):
+            problems.append({
+                'level': 'error', 'line': self.text.count('\n', 0, pos) + 1,
+                'message': 'Несбалансированная фигурная скобка `{}`'.format(
+                    self.text[pos])})
+        return problems
+
     def get_text(self):
-        tex_file = [f for f in os.listdir(self.path) if f.endswith('.tex')]
+        # служебные файлы (__article.tex) остаются в рабочем каталоге
+        # от предыдущих сборок и не являются исходным текстом статьи
+        tex_file = [f for f in os.listdir(self.full_path)
+                    if f.endswith('.tex') and not f.startswith('__')]
         if tex_file:
-            tex_file = os.path.join(self.path, tex_file[0])
+            tex_file = os.path.join(self.full_path, tex_file[0])
             with open(tex_file, 'rt') as f:
                 text = f.read()
             return text
@@ -67,8 +323,10 @@ class Article(ArticleBase):
     """
     Объектная модель статьи журнала.
     """
-    def __init__(self, path, lang='ru'):
-        super().__init__(path)
+    _scanner = None
+
+    def __init__(self, path, lang='ru', root=None):
+        super().__init__(path, root)
         self.lang = lang
         self.title = {}
         self.authors = {}
@@ -78,10 +336,27 @@ class Article(ArticleBase):
         self.abstracts = {}
         self.sections = {}
         self.bibliography = {}
+        self.bibitems = []
         self.article_text = None
         self.authors_en = None
         self.title_en = None
         self.keywords = {}
+        self._scanner = None
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        # в JSON кэше элементы списка литературы хранятся как списки
+        self.bibitems = [BibItem(*item)
+                         for item in state.get('bibitems', [])]
+
+    @property
+    def scanner(self):
+        """
+        Сканер исходного текста статьи, создается при первом обращении.
+        """
+        if self._scanner is None or self._scanner.text is not self.text:
+            self._scanner = LatexScanner(self.text)
+        return self._scanner
 
     @property
     def id(self):
@@ -89,6 +364,7 @@ class Article(ArticleBase):
         s = s.replace('\\;', '_')
         s = re.sub(' +', '_', s)
         s = re.sub(r'[.,]', '', s)
+        from transliterate import translit
         try:
             return translit(s, reversed=True)
         except Exception as e:
@@ -108,22 +384,34 @@ class Article(ArticleBase):
         text = re.sub(r'\s{2,}', ' ', text)
         return text.strip()
 
+    _brace_check_re = re.compile(r'\\.|%[^\n]*|[{}]', flags=re.DOTALL)
+
     @staticmethod
     def _check_balance_of_parantheses(s):
-        counter = 0
-        for ch in s:
+        """
+        Позиции несбалансированных фигурных скобок (лишних закрывающих и
+        незакрытых открывающих) в порядке следования. Экранированные скобки
+        и комментарии не учитываются.
+        """
+        opened = []
+        unmatched = []
+        for m in Article._brace_check_re.finditer(s):
+            ch = m.group()
             if ch == '{':
-                counter += 1
+                opened.append(m.start())
             elif ch == '}':
-                counter -= 1
-        return counter
+                if opened:
+                    opened.pop()
+                else:
+                    unmatched.append(m.start())
+        return sorted(unmatched + opened)
 
     def select_tag(self, tag, text, default=None):
-        m = re.search(tag + r'{.*?}+', text, flags=re.DOTALL)
-        if m:
-            t = text[m.start() + len(tag):m.end() - 1]
-            # if not self._check_balance_of_parantheses(t):
-            #     i = m.end()
+        scanner = self.scanner if text is self.text else LatexScanner(text)
+        token = scanner.first(tag.lstrip('\\'))
+        arg = scanner.argument(token.end) if token else None
+        if arg:
+            t = arg[0]
             t = re.sub(r'\n', ' ', t, flags=re.DOTALL)
             t = re.sub(r' {2,}', ' ', t, flags=re.DOTALL)
             return t
@@ -147,11 +435,14 @@ class Article(ArticleBase):
         """
         Извлечь авторов.
         """
-        text = self.text
+        scanner = self.scanner
         # russian case
         self.authors = []
-        for m1 in re.finditer(r'\\author{(.*)}', text):
-            authors = m1[1]
+        for token in scanner.commands('author'):
+            arg = scanner.argument(token.end)
+            if arg is None:
+                continue
+            authors = arg[0]
             authors = re.sub(r'\\[;,.:]+', ' ', authors)
             authors = re.sub(r'\s{2,}', ' ', authors)
             name_abbr_pattern = r'(?P<name>[A-ZА-ЯЁa-zа-яё]{1,2}\.)'
@@ -174,12 +465,11 @@ class Article(ArticleBase):
 
     def extract_en_title_and_authors(self):
         # english case
-        text = self.text
-        pattern = r'\\begin{abstractX}{(?P<title>.*?)}{(?P<authors>.*?)}'
-        m = re.search(pattern, text, flags=re.DOTALL)
-        if m:
-            self.authors_en = m['authors']
-            self.title_en = m['title']
+        env = self.scanner.environment('abstractX')
+        args = self.scanner.arguments(env.content_start, 2) if env else []
+        if len(args) == 2:
+            self.title_en = args[0][0]
+            self.authors_en = args[1][0]
         else:
             logger.error('Не найдены авторы (английский вариант) в {}!'.
                          format(self.path))
@@ -188,14 +478,14 @@ class Article(ArticleBase):
         """
         Извлечь русскую аннотацию.
         """
-        text = self.text
         self.abstracts['ru'] = ''
-        m = re.search(r'\\begin{abstractXr}\n*'
-                      r'{(.*?)}\n*{(.*?)}\n*(.*?)\n*'
-                      r'\\end{abstractXr}',
-                      text, flags=re.DOTALL)
-        if m:
-            self.abstracts['ru'] = m[3]
+        env = self.scanner.environment('abstractXr')
+        if env:
+            args = self.scanner.arguments(env.content_start, 2,
+                                          skip_space=True)
+            if len(args) == 2:
+                abstract = self.text[args[1][2]:env.content_end]
+                self.abstracts['ru'] = abstract.strip('\n')
         if not self.abstracts['ru']:
             logger.error('Не найдена русская аннотация в {}!'.format(self.path))
 
@@ -204,33 +494,30 @@ class Article(ArticleBase):
         Извлечь английскую аннотацию.
         """
         self.abstracts['en'] = ''
-        text = self.text
-        begin_pattern = r'\\begin\{abstractX\}.*'
-        m = re.search(begin_pattern, text)
-        if m:
-            p0 = m.end()
-            end_pattern = r'\\end\{abstractX\}'
-            m = re.search(end_pattern, text)
-            if m:
-                p1 = m.start()
-                abstract = text[p0:p1]
-                self.abstracts['en'] = abstract
+        env = self.scanner.environment('abstractX')
+        if env:
+            # пропускаем заголовок и авторов на английском языке
+            args = self.scanner.arguments(env.content_start, 2)
+            p0 = args[-1][2] if args else env.content_start
+            self.abstracts['en'] = self.text[p0:env.content_end]
         if not self.abstracts['en']:
             logger.error('Не найдена английская аннотация в {}!'.
                          format(self.path))
 
     def extract_keywords(self):
         self.keywords = {'ru': '', 'en': ''}
-        m = re.search(r'\\keywordsr{(.*?)}+', self.text, flags=re.DOTALL)
-        if m:
-            self.keywords['ru'] = m[1]
+        token = self.scanner.first('keywordsr')
+        arg = self.scanner.argument(token.end) if token else None
+        if arg:
+            self.keywords['ru'] = arg[0]
         else:
             logger.warning("Не найдены ключевые слова "
                            "на русском языке в {}".format(self.path))
 
-        m = re.search(r'\\keywords{(.*?)}+', self.text, flags=re.DOTALL)
-        if m:
-            self.keywords['en'] = m[1]
+        token = self.scanner.first('keywords')
+        arg = self.scanner.argument(token.end) if token else None
+        if arg:
+            self.keywords['en'] = arg[0]
         else:
             logger.warning("Не найдены ключевые слова "
                            "на английском языке в {}".format(self.path))
@@ -239,65 +526,93 @@ class Article(ArticleBase):
         """
         Извлечь разделы (главы) статьи.
         """
-        text = self.text
-        pattern = r'\\section\*?\{'
         self.sections = []
-        for m in re.finditer(pattern, text):
-            t = get_text_between_braces(text, m.end())
-            if t:
-                self.sections.append(self.normalize_text(t[0]))
+        for token in self.scanner.commands('section'):
+            arg = self.scanner.argument(token.end)
+            if arg:
+                self.sections.append(self.normalize_text(arg[0]))
         print(self.sections)
         if not self.sections:
             logger.error('Не найдены разделы в {}!'.format(self.path))
 
+    _bib_comment_re = re.compile(r'%\s*(.*)')
+    _bib_label_re = re.compile(r'\s*\[([^\]]*)\]')
+
     def extract_bibliography(self):
         """
         Извлечь список литературы.
+
+        Окружение thebibliography делится на элементы по позициям команд
+        \\bibitem за один проход. Текст элемента продолжается до следующего
+        \\bibitem или до первой команды \\end, комментарии удаляются, переводы
+        строк заменяются пробелами.
         """
         text = self.text
+        self.bibliography = {}
+        self.bibitems = []
 
-        m = re.search(r'\\begin{thebibliography}', text)
-        if m:
-            bib_begin_pos = m.start()
-        else:
-            bib_begin_pos = None
-
-        m = re.search(r'\\end{thebibliography}', text)
-        if m:
-            bib_end_pos = m.end()
-        else:
-            bib_end_pos = None
-
-        if not (bib_begin_pos and bib_end_pos):
+        env = self.scanner.environment('thebibliography')
+        if not env:
             logger.error('There is no the bibliography')
-        else:
-            bib_text = text[bib_begin_pos:bib_end_pos]
-            bib_text = re.sub(r'%\s*(.*)', '', bib_text)
-            bib_text = bib_text.replace('\n', ' ')
-
-            bib_ids = []
-            for m in re.finditer(r'\\bibitem{(?P<bibitem>.*?)}', bib_text):
-                bib_ids.append(m['bibitem'])
-
-            self.bibliography = {}
-            for bid in bib_ids:
-                p = '\\\\bibitem{{{}}}(?P<text>.*?)(?=\\\\bibitem|\\\\end)'.\
-                    format(bid)
-                m = re.search(p, bib_text, re.MULTILINE)
-                if m:
-                    bibtext = m['text']
-
-                    self.bibliography[bid] = bibtext
+            return
+
+        # закомментированные \bibitem в список не попадают
+        comments = [m.span() for m in
+                    self._bib_comment_re.finditer(text, env.start, env.end)]
+        items = []
+        i = 0
+        for token in self.scanner.commands('bibitem'):
+            if token.start < env.content_start:
+                continue
+            if token.start >= env.content_end:
+                break
+            while i < len(comments) and comments[i][1] <= token.start:
+                i += 1
+            if i < len(comments) and comments[i][0] <= token.start:
+                continue
+            items.append(token)
+
+        for n, token in enumerate(items):
+            end = items[n + 1].start if n + 1 < len(items) \
+                else env.content_end
+            pos = token.end
+            label = None
+            m = self._bib_label_re.match(text, pos)
+            if m:
+                label = m[1]
+                pos = m.end()
+            arg = self.scanner.argument(pos, skip_space=True)
+            if arg is None or arg[2] > end:
+                logger.warning('Некорректный \\bibitem в {}'.format(self.path))
+                continue
+            key, _, pos = arg
+            item_text = self._bib_comment_re.sub('', text[pos:end])
+            item_text = item_text.replace('\n', ' ')
+            item_end = item_text.find('\\end')
+            if item_end >= 0:
+                item_text = item_text[:item_end]
+            self.bibitems.append(BibItem(key, label, token.start, end,
+                                         item_text))
+            self.bibliography.setdefault(key, item_text)
+
+    _marker_value_re = re.compile(r'\s*(.*)(?=\})')
+
+    def select_marker(self, marker):
+        """
+        Значение после метки вида `УДК:` до закрывающей фигурной скобки.
+        """
+        for pos in self.scanner.markers.get(marker, []):
+            m = self._marker_value_re.match(self.text, pos)
+            if m:
+                return m[1]
+        return None
 
     def extract_udc(self):
         """
         Извлечь УДК.
         """
-        p = r'(?<=УДК\:)\s*(.*)(?=\})'
-        m = re.search(p, self.text)
-        if m:
-            self.udc = m[1]
-        else:
+        self.udc = self.select_marker('УДК')
+        if self.udc is None:
             self.udc = '???'
             logger.error('Не найден УДК в {}!'.format(self.path))
 
@@ -305,32 +620,99 @@ class Article(ArticleBase):
         """
         Извлечь MSC2010.
         """
-        p = r'(?<=MSC2010\:)\s*(.*)(?=\})'
-        m = re.search(p, self.text)
-        if m:
-            self.msc2010 = m[1]
-        else:
+        self.msc2010 = self.select_marker('MSC2010')
+        if self.msc2010 is None:
             self.msc2010 = '???'
             logger.error('Не найден MSC2010 в {}!'.format(self.path))
 
-    def update_image_path(self):
+    _graphics_re = re.compile(r'\\includegraphics.*?{(.+?)}')
+
+    def update_image_path(self, patcher):
         """
         Обновить пути к файлам изображений.
         """
-        text = self.article_text
-        pos = []
-        for m in re.finditer(r'\\includegraphics.*?{(.+?)}', text):
-            graph_text = text[m.start():m.end()]
-            m_image_name = re.search(r'{(.*)}', graph_text)
-            pos.append((m.start() + m_image_name.start(),
-                        m.start() + m_image_name.end()))
-        d = len(self.path) + 1
-        for i, p in enumerate(pos):
-            image_name = text[p[0] + i*d+1:p[1] + i*d-1]
-            text = text[:p[0] + i*d] + \
-                '{{{}/{}}}'.format(self.path, image_name) + \
-                text[p[1] + i*d:]
-        self.article_text = text
+        text = patcher.text
+        for m in self._graphics_re.finditer(text, patcher.start, patcher.end):
+            if patcher.overlaps(m.start(), m.end()):
+                continue
+            # имя файла - от первой открывающей скобки до конца команды
+            start = text.index('{', m.start(), m.end())
+            image_name = text[start + 1:m.end() - 1]
+            # EPS изображение, преобразованное в PDF (см. FigureCache)
+            converted = converted_figure_name(image_name)
+            if os.path.exists(os.path.join(self.full_path, converted)):
+                image_name = converted
+            patcher.replace(start, m.end(),
+                            '{{{}/{}}}'.format(self.path, image_name))
+
+    _comment_re = re.compile(r'(?<!\\)%[^\n]*')
+    _label_re = re.compile(r'\\label\s*{([^{}]*)}')
+    _ref_re = re.compile(r'\\(?:eq|page|auto)?ref\*?\s*{([^{}]*)}')
+    _cite_re = re.compile(r'\\(?:no)?cite[tp]?\*?\s*(?:\[[^\]]*\]\s*)*'
+                          r'{((?:[^{}]|{[^{}]*})*)}')
+
+    def check(self):
+        """
+        Проверить статью без компиляции: наличие данных, которые
+        извлекаются при компиляции (см. parse), \\markboth и окружения
+        abstractX, баланс фигурных скобок, ссылки
+        \\ref и \\cite и файлы изображений.
+        """
+        problems = super().check()
+        if self.text is None:
+            return problems
+        text = self.text
+
+        def add(level, message, pos=None):
+            line = text.count('\n', 0, pos) + 1 if pos is not None else None
+            problems.append({'level': level, 'line': line,
+                             'message': message})
+
+        self.parse()
+        if not self.scanner.first('markboth'):
+            add('error', 'Нет \\markboth, статья не будет скомпилирована')
+        if not self.scanner.environment('abstractX'):
+            add('error', 'Нет окружения abstractX')
+
+        # закомментированный текст не проверяется; длина текста и номера
+        # строк сохраняются
+        visible = self._comment_re.sub(lambda m: ' ' * len(m.group()), text)
+        labels = {}
+        for m in self._label_re.finditer(visible):
+            if m[1] in labels:
+                add('warning', 'Метка {} определена повторно'.format(m[1]),
+                    m.start())
+            labels.setdefault(m[1], m.start())
+        for m in self._ref_re.finditer(visible):
+            if m[1].strip() not in labels:
+                add('error', 'Ссылка на неопределенную метку {}'.format(
+                    m[1]), m.start())
+
+        keys = collections.Counter(item.key for item in self.bibitems)
+        for key, count in keys.items():
+            if count > 1:
+                add('warning', 'Повторный \\bibitem{{{}}}'.format(key))
+        cited = set()
+        for m in self._cite_re.finditer(visible):
+            for key in m[1].split(','):
+                key = key.strip().strip('{}').strip()
+                if not key:
+                    continue
+                cited.add(key)
+                if key not in keys:
+                    add('error', 'Ссылка на отсутствующий в списке '
+                                 'литературы источник {}'.format(key),
+                        m.start())
+        for item in self.bibitems:
+            if item.key not in cited:
+                add('warning', 'Источник {} не цитируется'.format(item.key),
+                    item.start)
+
+        for m in self._graphics_re.finditer(visible):
+            if FigureCache._resolve(self.full_path, m[1]) is None:
+                add('error', 'Нет файла изображения {}'.format(m[1]),
+                    m.start())
+        return problems
 
     @property
     def authors_str(self):
@@ -368,10 +750,13 @@ class Article(ArticleBase):
         return '{}\n{}\n'.format(ru_con, en_con)
 
     def extract_author_details(self):
-        p = r'\\authorInfo\{.*?\}\n{2,}'
         self.author_details = []
-        for m in re.finditer(p, self.text, flags=re.DOTALL):
-            self.author_details.append(self.text[m.start():m.end()])
+        for token in self.scanner.commands('authorInfo'):
+            args = self.scanner.arguments(token.end, 4, skip_space=True)
+            if not args:
+                continue
+            end = re.compile(r'\n*').match(self.text, args[-1][2]).end()
+            self.author_details.append(self.text[token.start:end])
 
     def parse(self):
         self.extract_title()
@@ -386,7 +771,9 @@ class Article(ArticleBase):
         self.extract_sections()
         self.extract_bibliography()
 
-    def update_title(self):
+    _title_re = re.compile(r'\\title{.*?}+', flags=re.DOTALL)
+
+    def update_title(self, patcher):
         # find \footnote
         p = self.title['ru'].find(r'\footnote')
         if p >= 0:
@@ -397,45 +784,68 @@ class Article(ArticleBase):
             upper_title = self.title['ru'].upper()
 
         if self.title['ru']:
-            m = re.search(r'\\title{.*?}+', self.article_text, flags=re.DOTALL)
-            if m:
-                self.article_text = re.sub(
-                    r'\\title{.*?}+', '', self.article_text, flags=re.DOTALL)
-                self.article_text = self.article_text[:m.start()] \
-                    + '\\title{{{}}}'.format(upper_title) \
-                    + self.article_text[m.start():]
-
-    def update_section(self, section):
-        # TODO: replace by regular expression
-        pattern = f'\\section{{{section}}}'
-        bold_pattern = f'\\section{{\\textbf{{{section}}}}}'
-        pattern_with_asterix = f'\\section*{{{section}}}'
-        bold_pattern_with_asterix = f'\\section*{{\\textbf{{{section}}}}}'
-
-        if pattern in self.article_text:
-            self.article_text = self.article_text.replace(pattern,
-                                                          bold_pattern)
-        elif pattern_with_asterix in self.article_text:
-            self.article_text = self.article_text.replace(
-                pattern_with_asterix, bold_pattern_with_asterix)
-
-        if bold_pattern not in self.article_text \
-                and bold_pattern_with_asterix not in self.article_text:
-            logger.warning(f"Раздел `{section}` "
-                           f"в статье `{self.title['ru']}` "
-                           f"не был выделен жирным!")
-
-    art_path = property(lambda self: os.path.join(self.path, '__article.tex'))
-
-    def remove_russian_abstract(self):
-        pattern = r'\\begin{abstractXr}\n*' \
-                  r'{(.*?)}\n*{(.*?)}\n*(.*?)\n*' \
-                  r'\\end{abstractXr}'
-        self.article_text = re.sub(pattern, '\n', self.article_text,
-                                   flags=re.DOTALL)
-        pattern = r'\\keywordsr{(.*?)}+'
-        self.article_text = re.sub(pattern, '\n', self.article_text,
-                                   flags=re.DOTALL)
+            # первое вхождение \title заменяется заголовком в верхнем
+            # регистре, остальные удаляются
+            replacement = '\\title{{{}}}'.format(upper_title)
+            for m in self._title_re.finditer(patcher.text, patcher.start,
+                                             patcher.end):
+                if patcher.overlaps(m.start(), m.end()):
+                    continue
+                patcher.replace(m.start(), m.end(), replacement)
+                replacement = ''
+
+    def update_sections(self, patcher):
+        """
+        Выделить заголовки разделов жирным шрифтом.
+
+        Если раздел встречается без звездочки, выделяются только такие его
+        вхождения, иначе - вхождения \\section*.
+        """
+        sections = set(self.sections)
+        found = {False: collections.defaultdict(list),
+                 True: collections.defaultdict(list)}
+        headers = set()
+        for token in self.scanner.commands('section'):
+            if token.start < patcher.start:
+                continue
+            if token.start >= patcher.end:
+                break
+            arg = self.scanner.argument(token.end)
+            if arg is None or arg[2] > patcher.end \
+                    or patcher.overlaps(token.start, arg[2]):
+                continue
+            headers.add(arg[0])
+            if arg[0] in sections:
+                found[token.star][arg[0]].append((token.start, arg[2]))
+
+        bold = set()
+        for section in self.sections:
+            if section not in bold:
+                star = section not in found[False]
+                for start, end in found[star].get(section, ()):
+                    patcher.replace(start, end, '\\section{}{{\\textbf{{{}}}}}'
+                                    .format('*' if star else '', section))
+                    bold.add(section)
+            if section not in bold \
+                    and '\\textbf{{{}}}'.format(section) not in headers:
+                logger.warning(f"Раздел `{section}` "
+                               f"в статье `{self.title['ru']}` "
+                               f"не был выделен жирным!")
+
+    _abstract_ru_re = re.compile(r'\\begin{abstractXr}\n*'
+                                 r'{(.*?)}\n*{(.*?)}\n*(.*?)\n*'
+                                 r'\\end{abstractXr}', flags=re.DOTALL)
+    _keywords_ru_re = re.compile(r'\\keywordsr{(.*?)}+', flags=re.DOTALL)
+
+    def remove_russian_abstract(self, patcher):
+        text = patcher.text
+        for m in self._abstract_ru_re.finditer(text, patcher.start,
+                                               patcher.end):
+            patcher.replace(m.start(), m.end(), '\n')
+        for m in self._keywords_ru_re.finditer(text, patcher.start,
+                                               patcher.end):
+            if not patcher.overlaps(m.start(), m.end()):
+                patcher.replace(m.start(), m.end(), '\n')
 
     def compile(self):
         """
@@ -446,22 +856,25 @@ class Article(ArticleBase):
             2. Добавить служебную информацию.
         """
         self.parse()
-        m_start = re.search(r'\\markboth', self.text)
-        m_end = re.search(r'\\end{thebibliography}', self.text)
+        m_start = self.scanner.first('markboth')
+        m_end = self.scanner.environment('thebibliography')
         if m_start and m_end:
-            self.article_text = self.text[m_start.start():m_end.end()]
-            self.remove_russian_abstract()
-            self.article_text = \
-                r'\input{__init_counters__}' + '\n' + \
-                f'\\input{{__to_{self.lang}__}}' + '\n\n' + \
-                self.add_content_lines() + \
-                fr'\label{{{self.begin_label}}}' + '\n\n' + \
-                self.article_text + '\n\n' + \
-                fr'\label{{{self.end_label}}}'
-            self.update_title()
-            for s in self.sections:
-                self.update_section(s)
-            self.update_image_path()
+            # все правки задаются позициями в исходном тексте и применяются
+            # одной склейкой
+            patcher = TextPatcher(self.text, m_start.start, m_end.end)
+            self.remove_russian_abstract(patcher)
+            patcher.insert(
+                patcher.start,
+                r'\input{__init_counters__}' + '\n' +
+                f'\\input{{__to_{self.lang}__}}' + '\n\n' +
+                self.add_content_lines() +
+                fr'\label{{{self.begin_label}}}' + '\n\n')
+            patcher.insert(patcher.end,
+                           '\n\n' + fr'\label{{{self.end_label}}}')
+            self.update_title(patcher)
+            self.update_sections(patcher)
+            self.update_image_path(patcher)
+            self.article_text = patcher.apply()
             with open(self.art_path, 'wt') as f:
                 f.write(self.article_text)
         else:
@@ -479,20 +892,1307 @@ class Article(ArticleBase):
             },
             'УДК': self.udc,
             'MSC2010': self.msc2010,
+            'keywords': self.keywords,
+            'title_en': self.title_en,
+            'authors_en': self.authors_en,
             'sections': self.sections,
             'text': self.article_text,
             'bibliography': self.bibliography,
         }
 
 
+# размеры и время изменения исходных файлов, размещенных sync_tree,
+# хранятся в каталоге назначения
+sync_manifest_name = '.tvim_sync.json'
+
+
+def stage_file(src, dst, link=True):
+    """
+    Поместить файл src в рабочий каталог под именем dst.
+
+    Файлы, которые компилятор только читает, связываются жесткой ссылкой
+    (или символической, если жесткая невозможна), остальные копируются.
+    Существующий dst предварительно удаляется, чтобы запись в него не
+    изменила исходный файл.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def sync_tree(src, dst, prune=False, materialize=()):
+    """
+    Синхронизировать каталог dst с каталогом src. Обновляются только новые и
+    измененные файлы: размер и время изменения исходного файла сравниваются
+    с записанными при прошлой синхронизации (sync_manifest_name), а не с
+    файлом в dst. Поэтому файл, который заменил другой этап сборки
+    (уменьшенное изображение, см. FigureCache), остается на месте, пока не
+    изменится исходный файл.
+
+    Parameters
+    ----------
+        src: str
+            Исходный каталог
+        dst: str
+            Каталог назначения
+        prune: bool
+            Удалять из dst файлы и каталоги, которых нет в src. Служебные
+            файлы, имена которых начинаются с `__`, не удаляются.
+        materialize: collection
+            Имена файлов, которые компилятор переписывает или дополняет при
+            каждой сборке; они копируются заново при каждой синхронизации.
+            Остальные файлы связываются ссылками (см. stage_file), служебные
+            файлы `__*` копируются.
+    """
+    manifest_path = os.path.join(dst, sync_manifest_name)
+    try:
+        with open(manifest_path, 'rt') as f:
+            staged = json.load(f)
+    except (OSError, ValueError):
+        staged = {}
+    synced = {}
+    _sync_dir(src, dst, '', prune, materialize, staged, synced)
+    with open(manifest_path, 'wt') as f:
+        json.dump(synced, f)
+
+
+def _sync_dir(src, dst, prefix, prune, materialize, staged, synced):
+    os.makedirs(dst, exist_ok=True)
+    names = set()
+    for entry in os.scandir(src):
+        names.add(entry.name)
+        target = os.path.join(dst, entry.name)
+        name = prefix + entry.name
+        if entry.is_dir():
+            _sync_dir(entry.path, target, name + '/', prune, materialize,
+                      staged, synced)
+            continue
+        src_stat = entry.stat()
+        synced[name] = [src_stat.st_size, src_stat.st_mtime_ns]
+        if entry.name in materialize:
+            stage_file(entry.path, target, link=False)
+        elif staged.get(name) != synced[name] \
+                or not os.path.lexists(target):
+            stage_file(entry.path, target,
+                       link=not entry.name.startswith('__'))
+    if prune:
+        for entry in os.scandir(dst):
+            if entry.name in names or entry.name.startswith('__') \
+                    or entry.name == sync_manifest_name:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+
+class BuildCache:
+    """
+    Кэш скомпилированных статей.
+
+    Для каждого каталога статьи хранится ключ (хэш файлов .tex и
+    изображений, параметров статьи и версии компилятора), текст
+    `__article.tex` и извлеченные метаданные. Если ключ не изменился,
+    статья не компилируется повторно.
+    """
+    extensions = ('.tex', '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif',
+                  '.tiff', '.pdf', '.eps', '.ps', '.svg')
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _compiler_fingerprint():
+        # вычисляется один раз в процессе, а не для каждой статьи
+        h = hashlib.sha256(__version__.encode())
+        with open(__file__, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def key(self, task):
+        """
+        Ключ кэша для задачи компиляции статьи.
+        """
+        article_cls, workspace, path, *args = task
+        full_path = os.path.join(workspace, path)
+        h = hashlib.sha256()
+        h.update(self._compiler_fingerprint().encode())
+        h.update(repr((article_cls.__name__, path, args)).encode())
+        for root, dirs, files in os.walk(full_path):
+            dirs.sort()
+            for name in sorted(files):
+                # преобразованные EPS изображения меняют текст статьи
+                if name.startswith('__') and not name.endswith('-eps.pdf') \
+                        or not name.lower().endswith(self.extensions):
+                    continue
+                file_path = os.path.join(root, name)
+                h.update(os.path.relpath(file_path, full_path).encode())
+                with open(file_path, 'rb') as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    def _entry_path(self, task):
+        return os.path.join(self.path,
+                            os.path.basename(task[2]) + '.json')
+
+    def load(self, task, key):
+        """
+        Восстановить статью из кэша или вернуть None.
+        """
+        try:
+            with open(self._entry_path(task), 'rt') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        article_cls = task[0]
+        article = article_cls.__new__(article_cls)
+        article.__setstate__(entry['state'])
+        # рабочий каталог выпуска мог измениться
+        article._root = task[1]
+        with open(article.art_path, 'wt') as f:
+            f.write(article.article_text)
+        return article
+
+    def store(self, task, key, article):
+        """
+        Сохранить скомпилированную статью в кэш.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        entry = {'key': key, 'state': article.__getstate__()}
+        with open(self._entry_path(task), 'wt') as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+
+_aux_label_re = re.compile(r'\\newlabel\{(.+?)\}\{\{[^{}]*\}\{(\d+)\}')
+
+
+def aux_label_pages(*paths):
+    """
+    Номера страниц меток (\\newlabel) из .aux файлов. Метки с номером
+    страницы не арабскими цифрами пропускаются, отсутствующие файлы тоже.
+
+    Returns
+    -------
+        dict
+            Номера страниц по именам меток
+    """
+    pages = {}
+    for path in paths:
+        try:
+            with open(path, 'rt', errors='replace') as f:
+                aux = f.read()
+        except FileNotFoundError:
+            continue
+        pages.update((m[1], int(m[2])) for m in _aux_label_re.finditer(aux))
+    return pages
+
+
+def pdflatex_state(jobname, cwd=None):
+    """
+    Хэш вспомогательных файлов pdflatex (.aux, .toc, .tec) и параметров
+    выпуска в каталоге cwd. Пока он меняется от прохода к проходу, ссылки
+    на страницы и содержание еще не установились.
+    """
+    h = hashlib.sha256()
+    for name in [jobname + ext for ext in ('.aux', '.toc', '.tec')] + \
+            ['__params__.tex', '__params_en__.tex']:
+        h.update(name.encode())
+        try:
+            with open(os.path.join(cwd or os.curdir, name), 'rb') as f:
+                h.update(f.read())
+        except FileNotFoundError:
+            pass
+    return h.hexdigest()
+
+
+def pdflatex_command(jobname, source=None, fmt=None):
+    """
+    Командная строка pdflatex для задания jobname.
+    """
+    cmd = ['pdflatex', '-halt-on-error', '-file-line-error',
+           '-jobname=' + jobname, source or jobname + '.tex']
+    if fmt:
+        cmd.insert(1, '-fmt=' + fmt)
+    return cmd
+
+
+class PdflatexMonitor:
+    """
+    Разбор вывода pdflatex по мере его появления.
+
+    Монитор находит фатальные ошибки TeX, признаки зацикливания (одна и та
+    же строка много раз подряд, номер страницы намного больше ожидаемого)
+    и лавину предупреждений Overfull/Underfull \\hbox. Ошибку TeX pdflatex
+    завершает сам (-halt-on-error), в остальных случаях сборка обречена,
+    и pdflatex нужно остановить, не дожидаясь конца прохода.
+
+    Ошибка относится к статье по имени файла в сообщении
+    (-file-line-error), по открытому в этот момент файлу статьи или, если
+    открытые файлы неизвестны, по номеру текущей страницы и меткам
+    `<id>_begin` из .aux файла предыдущего прохода.
+    """
+    repeat_limit = 200
+    overfull_limit = 1000
+    # предельный номер страницы, если ожидаемое количество неизвестно
+    max_pages = 3000
+    # секунд без вывода, после которых pdflatex считается зациклившимся
+    stall_timeout = 300
+    tail_size = 12
+
+    _file_line_error_re = re.compile(r'^(\S+?\.tex):(\d+): (.*)')
+    _article_re = re.compile(r'(?:\./)?(articles/[^/()\s]+)/')
+    # открытие файла `(путь` или другой скобки, закрытие скобки, номер
+    # сверстанной страницы `[n`, конец номера `]` и прочие слова
+    _token_re = re.compile(
+        r'\((?P<file>[^\s()\[\]]*\.[A-Za-z][A-Za-z0-9]*(?=[\s()\[\]]|$))?'
+        r'|(?P<close>\))|\[(?P<page>\d+)(?=[\s\]]|$)|(?P<end>\])'
+        r'|[^\s()\[\]]+')
+    _box_re = re.compile(r'^(?:Overfull|Underfull) \\[hv]box')
+
+    def __init__(self, articles=None, labels=None, aux_path=None,
+                 expected_pages=None):
+        """
+        Parameters
+        ----------
+            articles: dict
+                Описания статей (авторы) по каталогам статей
+                (`articles/<имя>`)
+            labels: dict
+                Каталоги статей по меткам `<id>_begin`
+            aux_path: str
+                .aux файл задания, из которого берутся страницы меток
+            expected_pages: int
+                Ожидаемое количество страниц
+        """
+        self.articles = articles or {}
+        self.labels = labels or {}
+        self.aux_path = aux_path
+        self.expected_pages = expected_pages
+        self.start_pass()
+
+    def start_pass(self):
+        self.failure = None
+        self.error = None
+        self.current = None
+        # открытые файлы и скобки сообщений (None) в выводе pdflatex
+        self.files = []
+        self.page = None
+        self.overfull = 0
+        self.tail = collections.deque(maxlen=self.tail_size)
+        self._last_line = None
+        self._repeats = 0
+        self.last_output = time.monotonic()
+        # страницы начала статей из предыдущего прохода
+        self.first_pages = []
+        if self.aux_path and self.labels:
+            pages = aux_label_pages(self.aux_path)
+            self.first_pages = sorted(
+                (pages[label], path) for label, path in self.labels.items()
+                if label in pages)
+
+    def article_at(self, path=None):
+        """
+        Каталог статьи, к которой относится текущее место вывода pdflatex:
+        по имени файла path, по открытому файлу (см. _scan) или, если
+        открытые файлы неизвестны, по номеру страницы.
+        """
+        if path:
+            m = self._article_re.match(path)
+            return m[1] if m else None
+        if self.current or any(self.files):
+            return self.current
+        if self.page is not None and self.first_pages:
+            i = bisect.bisect_right(self.first_pages, (self.page, '\uffff'))
+            if i:
+                return self.first_pages[i - 1][1]
+        return None
+
+    def _record(self, reason, message, path=None, line=None):
+        article = self.article_at(path)
+        return {'reason': reason, 'message': message, 'article': article,
+                'authors': self.articles.get(article), 'file': path,
+                'line': line, 'page': self.page, 'context': list(self.tail)}
+
+    def _fail(self, reason, message):
+        self.failure = self._record(reason, message)
+        return reason
+
+    def feed(self, line):
+        """
+        Обработать строку вывода.
+
+        Returns
+        -------
+            str или None
+                Причина, по которой pdflatex нужно остановить, или None
+        """
+        self.last_output = time.monotonic()
+        self.tail.append(line)
+        if self.failure:
+            return None
+        if line == self._last_line:
+            self._repeats += 1
+            if self._repeats >= self.repeat_limit:
+                return self._fail('loop', 'Строка повторяется {} раз '
+                                          'подряд: {}'.format(self._repeats,
+                                                              line))
+        else:
+            self._last_line = line
+            self._repeats = 1
+
+        self._scan(line)
+        limit = 2 * self.expected_pages + 20 if self.expected_pages \
+            else self.max_pages
+        if self.page and self.page > limit:
+            return self._fail('pages', 'Страница {} при ожидаемых {}'.format(
+                self.page, self.expected_pages or '?'))
+
+        # после ошибки pdflatex останавливается сам (-halt-on-error);
+        # строки `!` бывают и предупреждениями pdfTeX, поэтому ошибка
+        # только запоминается (см. finish)
+        if self.error is None:
+            m = self._file_line_error_re.match(line)
+            if m:
+                self.error = self._record('error', m[3], m[1], int(m[2]))
+            elif line.startswith('! '):
+                self.error = self._record('error', line[2:])
+        if self._box_re.match(line):
+            self.overfull += 1
+            if self.overfull >= self.overfull_limit:
+                return self._fail('boxes', 'Предупреждений Overfull/'
+                                           'Underfull box: {}'.format(
+                                               self.overfull))
+        return None
+
+    def _scan(self, line):
+        """
+        Отследить открытие и закрытие файлов и номера сверстанных страниц.
+
+        Текущая статья - статья самого внутреннего открытого файла; если
+        это не файл статьи, текущей статьи нет. Номер страницы `[n`
+        учитывается только в начале строки или после файла или другой
+        страницы, чтобы числа в скобках внутри сообщений (например,
+        ссылки [12] в Overfull \\hbox) не принимались за страницы.
+        """
+        after = True
+        for m in self._token_re.finditer(line):
+            if m.group().startswith('('):
+                self.files.append(m['file'])
+            elif m['close']:
+                if self.files:
+                    self.files.pop()
+            elif m['page']:
+                if after:
+                    # [n] выводится после того, как страница n сверстана
+                    self.page = int(m['page']) + 1
+            elif not m['end']:
+                after = False
+                continue
+            after = True
+        path = next((f for f in reversed(self.files) if f), None)
+        m = self._article_re.match(path) if path else None
+        self.current = m[1] if m else None
+
+    def finish(self, returncode):
+        """
+        Завершить проход с кодом завершения pdflatex returncode.
+
+        Returns
+        -------
+            bool
+                True, если проход завершился успешно
+        """
+        if self.failure is None and returncode != 0:
+            self.failure = self.error or self._record(
+                'error', 'pdflatex завершился с кодом {}'.format(returncode))
+            # после сообщения об ошибке pdflatex выводит строку, в
+            # которой она произошла
+            self.failure['context'] = list(self.tail)
+        return self.failure is None
+
+    def stalled(self):
+        if time.monotonic() - self.last_output > self.stall_timeout:
+            return self._fail('stall', 'Нет вывода {} с'.format(
+                self.stall_timeout))
+        return None
+
+    def summary(self):
+        """
+        Описание ошибки в одну строку: где и что произошло.
+        """
+        f = self.failure
+        if not f:
+            return ''
+        where = []
+        if f['article']:
+            where.append('статья {}{}'.format(
+                f['article'], ' ({})'.format(f['authors'])
+                if f['authors'] else ''))
+        if f['file']:
+            where.append('{}:{}'.format(f['file'], f['line']))
+        if f['page']:
+            where.append('страница {}'.format(f['page']))
+        return 'pdflatex{}: {}'.format(
+            ' ({})'.format(', '.join(where)) if where else '', f['message'])
+
+    def report(self):
+        """
+        Описание ошибки для пользователя с последними строками вывода.
+        """
+        if not self.failure:
+            return ''
+        lines = ['ОШИБКА ' + self.summary()]
+        lines.extend('    ' + line for line in self.failure['context'])
+        return '\n'.join(lines)
+
+
+def _run_monitored(cmd, cwd, monitor):
+    """
+    Запустить pdflatex, передавая его вывод монитору построчно.
+    Процесс останавливается, как только монитор сообщает, что сборка
+    обречена, или если pdflatex долго ничего не выводит.
+
+    Returns
+    -------
+        bool
+            True, если pdflatex завершился успешно
+    """
+    # без переноса длинных строк имена файлов и сообщения не разрываются
+    env = dict(os.environ, max_print_line='10000')
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    done = threading.Event()
+
+    def watchdog():
+        while not done.wait(1):
+            if monitor.stalled():
+                proc.kill()
+                return
+
+    watchdog_thread = threading.Thread(target=watchdog, daemon=True)
+    watchdog_thread.start()
+    try:
+        for raw in proc.stdout:
+            if monitor.feed(raw.decode('utf-8', 'replace').rstrip('\r\n')):
+                proc.kill()
+                break
+        proc.stdout.close()
+        returncode = proc.wait()
+    finally:
+        done.set()
+        watchdog_thread.join()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    return monitor.finish(returncode)
+
+
+def run_pdflatex(jobname, source=None, max_passes=4, after_pass=None,
+                 fmt=None, cwd=None, monitor=None):
+    """
+    Запускать pdflatex до тех пор, пока вспомогательные файлы не перестанут
+    изменяться, но не более max_passes раз.
+
+    Parameters
+    ----------
+        jobname: str
+            Имя задания pdflatex
+        source: str
+            Исходный файл или код TeX; по умолчанию `<jobname>.tex`
+        max_passes: int
+            Максимальное количество проходов
+        after_pass: callable
+            Вызывается после каждого успешного прохода
+        fmt: str
+            Имя предварительно скомпилированного формата (.fmt)
+        cwd: str
+            Каталог, в котором запускается pdflatex (по умолчанию текущий)
+        monitor: PdflatexMonitor
+            Монитор вывода pdflatex; при ошибке его отчет выводится в лог
+
+    Returns
+    -------
+        tuple
+            Признак успешного завершения и длительности проходов в секундах
+    """
+    cmd = pdflatex_command(jobname, source, fmt)
+    monitor = monitor or PdflatexMonitor()
+    passes = []
+    state = pdflatex_state(jobname, cwd)
+    while len(passes) < max_passes:
+        start = time.perf_counter()
+        monitor.start_pass()
+        ok = _run_monitored(cmd, cwd, monitor)
+        passes.append(time.perf_counter() - start)
+        if not ok:
+            logger.error(monitor.report())
+            return False, passes
+        if after_pass:
+            after_pass()
+        new_state = pdflatex_state(jobname, cwd)
+        if new_state == state:
+            break
+        state = new_state
+    else:
+        if max_passes > 1:
+            logger.warning('Ссылки и содержание {} не установились '
+                           'за {} проходов pdflatex'.format(jobname,
+                                                            max_passes))
+    return True, passes
+
+
+class FormatCache:
+    """
+    Кэш форматов pdflatex с предварительно загруженной преамбулой журнала.
+
+    Преамбула tvim_main.tex (до \\endofdump) вместе с tvim.sty
+    сохраняется в .fmt файл с помощью пакета mylatexformat. Имя формата
+    определяется хэшем преамбулы, tvim.sty и версии pdflatex, поэтому при
+    изменении ресурсов формат пересобирается автоматически.
+    """
+    fmt_name = '__preamble__'
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def key(main_path, sty_path='tvim.sty'):
+        with open(main_path, 'rt') as f:
+            main = f.read()
+        pos = main.find('endofdump')
+        if pos < 0:
+            return None
+        h = hashlib.sha256(main[:pos].encode())
+        with open(sty_path, 'rb') as f:
+            h.update(f.read())
+        res = subprocess.run(['pdflatex', '--version'],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        h.update(res.stdout.split(b'\n', 1)[0])
+        return h.hexdigest()
+
+    def prepare(self, main_path, cwd=None):
+        """
+        Подготовить формат для файла main_path в каталоге cwd (по умолчанию
+        в текущем).
+
+        Returns
+        -------
+            str или None
+                Имя формата для опции -fmt или None, если формат собрать
+                не удалось
+        """
+        cwd = cwd or os.curdir
+        key = self.key(os.path.join(cwd, main_path),
+                       os.path.join(cwd, 'tvim.sty'))
+        if key is None:
+            logger.warning('В {} нет \\endofdump, преамбула не будет '
+                           'кэширована'.format(main_path))
+            return None
+        cached = os.path.join(self.path, key + '.fmt')
+        target = os.path.join(cwd, self.fmt_name + '.fmt')
+        if os.path.exists(cached):
+            shutil.copyfile(cached, target)
+            return self.fmt_name
+        print('Сборка формата с преамбулой журнала...')
+        cmd = ['pdflatex', '-ini', '-interaction=batchmode',
+               '-jobname=' + self.fmt_name, '&pdflatex',
+               'mylatexformat.ltx', main_path]
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, cwd=cwd)
+        if res.returncode != 0 or not os.path.exists(target):
+            logger.warning('Не удалось собрать формат, преамбула будет '
+                           'загружаться при каждом проходе. Посмотрите, '
+                           'пожалуйста, {}.log'.format(self.fmt_name))
+            return None
+        os.makedirs(self.path, exist_ok=True)
+        # кэш форматов общий для всех выпусков, которые могут собираться
+        # одновременно (--batch, потоки), поэтому файл заменяется атомарно
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        os.close(fd)
+        shutil.copyfile(target, tmp_path)
+        os.replace(tmp_path, cached)
+        return self.fmt_name
+
+
+def converted_figure_name(name):
+    """
+    Имя PDF файла, в который преобразуется EPS изображение name (путь
+    относительно каталога статьи, расширение может быть опущено).
+    """
+    head, tail = os.path.split(name)
+    stem, ext = os.path.splitext(tail)
+    if ext.lower() not in FigureCache.eps_extensions:
+        stem = tail
+    return os.path.join(head, '__{}-eps.pdf'.format(stem))
+
+
+class FigureCache:
+    """
+    Кэш подготовленных изображений.
+
+    EPS изображения преобразуются в PDF (pdflatex не читает EPS), растровые
+    изображения, размер которых в пикселях больше, чем нужно для печати
+    области текста с разрешением dpi, уменьшаются. Результаты хранятся под
+    хэшем исходного файла и параметров преобразования, поэтому кэш общий
+    для всех сборок и выпусков.
+    """
+    dpi = 300
+    # область текста (см. tvim.sty), см
+    text_size = (16, 21.5)
+    eps_extensions = ('.eps', '.ps')
+    raster_extensions = ('.png', '.jpg', '.jpeg')
+    # порядок поиска файла по имени без расширения, как в graphicx
+    search_extensions = ('.pdf', '.png', '.jpg', '.jpeg', '.eps', '.ps')
+
+    def __init__(self, path, dpi=None):
+        self.path = path
+        self.dpi = dpi or self.dpi
+
+    @staticmethod
+    def _file_hash(path, *params):
+        h = hashlib.sha256(repr(params).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _store(self, key, ext, produce, remember_skip=False):
+        """
+        Путь к файлу кэша key + ext; если его нет, он создается функцией
+        produce(path). Файл кэша заменяется атомарно, так как один кэш
+        используют одновременно собираемые выпуски.
+
+        Если produce вернула False, результата нет (None). При
+        remember_skip это запоминается пустым файлом key.skip, и produce
+        для того же ключа больше не вызывается.
+        """
+        cached = os.path.join(self.path, key + ext)
+        if os.path.exists(cached):
+            return cached
+        skip_path = os.path.join(self.path, key + '.skip')
+        if remember_skip and os.path.exists(skip_path):
+            return None
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=ext, dir=self.path)
+        os.close(fd)
+        # файлы кэша связываются с рабочими каталогами ссылками
+        os.chmod(tmp_path, 0o644)
+        try:
+            if not produce(tmp_path):
+                if remember_skip:
+                    open(skip_path, 'wb').close()
+                return None
+            os.replace(tmp_path, cached)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return cached
+
+    @staticmethod
+    def _eps_converter():
+        if shutil.which('epstopdf'):
+            return 'epstopdf'
+        for gs in ('gs', 'gswin64c', 'gswin32c'):
+            if shutil.which(gs):
+                return gs
+        return None
+
+    def convert_eps(self, src):
+        """
+        Преобразовать EPS файл в PDF. Возвращает путь к файлу в кэше или
+        None, если преобразование невозможно.
+        """
+        converter = self._eps_converter()
+        if converter is None:
+            logger.warning('Не найден epstopdf или ghostscript, {} не будет '
+                           'преобразован в PDF'.format(src))
+            return None
+
+        def produce(dst):
+            if converter == 'epstopdf':
+                cmd = [converter, '--outfile=' + dst, src]
+            else:
+                cmd = [converter, '-q', '-dSAFER', '-dBATCH', '-dNOPAUSE',
+                       '-dEPSCrop', '-sDEVICE=pdfwrite',
+                       '-sOutputFile=' + dst, src]
+            res = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+            if res.returncode != 0:
+                logger.error('Не удалось преобразовать {} в PDF: {}'.format(
+                    src, res.stdout.decode(errors='replace').strip()))
+                return False
+            return True
+
+        return self._store(self._file_hash(src, 'eps', converter), '.pdf',
+                           produce)
+
+    def downsample(self, src):
+        """
+        Уменьшить растровое изображение до разрешения печати. Возвращает
+        путь к файлу в кэше или None, если уменьшать изображение не нужно
+        или Pillow не установлен.
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        try:
+            with Image.open(src) as img:
+                width, height = img.size
+        except OSError:
+            logger.warning('Не удалось прочитать изображение {}'.format(src))
+            return None
+        long_side, short_side = (round(s / 2.54 * self.dpi) for s in
+                                 sorted(self.text_size, reverse=True))
+        scale = min(long_side / max(width, height),
+                    short_side / min(width, height))
+        if scale >= 1:
+            return None
+
+        def produce(dst):
+            with Image.open(src) as img:
+                fmt = img.format
+                # естественный размер изображения (пиксели / dpi) не
+                # меняется, чтобы не изменилась верстка рисунков без
+                # явно заданной ширины
+                dpi = img.info.get('dpi', (72, 72))
+                if img.mode not in ('1', 'L', 'LA', 'RGB', 'RGBA', 'CMYK'):
+                    img = img.convert('RGBA')
+                img = img.resize((max(1, round(width * scale)),
+                                  max(1, round(height * scale))),
+                                 Image.LANCZOS)
+                options = {'dpi': (dpi[0] * scale, dpi[1] * scale)}
+                if fmt == 'JPEG':
+                    options.update(quality=90, optimize=True)
+                else:
+                    options.update(optimize=True)
+                img.save(dst, fmt, **options)
+            return os.path.getsize(dst) < os.path.getsize(src)
+
+        # уменьшенный файл может оказаться не меньше исходного; это
+        # запоминается, чтобы не уменьшать изображение при каждой сборке
+        ext = os.path.splitext(src)[1].lower()
+        return self._store(self._file_hash(src, 'raster', self.dpi,
+                                           self.text_size), ext, produce,
+                           remember_skip=True)
+
+    @classmethod
+    def _resolve(cls, article_dir, name):
+        path = os.path.join(article_dir, name)
+        if os.path.splitext(name)[1].lower() in cls.search_extensions:
+            return path if os.path.isfile(path) else None
+        for ext in cls.search_extensions:
+            if os.path.isfile(path + ext):
+                return path + ext
+        return None
+
+    def prepare(self, article_dir):
+        """
+        Подготовить изображения статьи в рабочем каталоге: EPS файлы
+        преобразуются в `__<имя>-eps.pdf` (см. Article.update_image_path),
+        большие растровые изображения заменяются уменьшенными.
+
+        Returns
+        -------
+            list
+                Подготовленные изображения: имя, действие ('eps' или
+                'raster'), исходный и новый размер файла
+        """
+        names = set()
+        for name in os.listdir(article_dir):
+            if name.endswith('.tex') and not name.startswith('__'):
+                with open(os.path.join(article_dir, name), 'rt') as f:
+                    names.update(Article._graphics_re.findall(f.read()))
+        prepared = []
+        seen = set()
+        for name in sorted(names):
+            src = self._resolve(article_dir, name)
+            if src is None or src in seen:
+                continue
+            seen.add(src)
+            size = os.path.getsize(src)
+            ext = os.path.splitext(src)[1].lower()
+            if ext in self.eps_extensions:
+                action, dst = 'eps', os.path.join(
+                    article_dir, converted_figure_name(name))
+                cached = self.convert_eps(src)
+            elif ext in self.raster_extensions:
+                action, dst = 'raster', src
+                cached = self.downsample(src)
+            else:
+                continue
+            if cached is None:
+                continue
+            if not os.path.exists(dst) or not os.path.samefile(cached, dst):
+                # src может быть жесткой ссылкой на исходный файл, поэтому
+                # файл заменяется, а не перезаписывается
+                stage_file(cached, dst)
+            prepared.append((name, action, size, os.path.getsize(dst)))
+        return prepared
+
+
+def _prepare_figures(task):
+    """
+    Подготовить изображения одной статьи (см. FigureCache.prepare).
+    Вынесено на уровень модуля для пула процессов.
+    """
+    figure_cache, article_dir = task
+    return figure_cache.prepare(article_dir)
+
+
+def pdf_page_count(pdf_path):
+    """
+    Количество страниц PDF файла.
+
+    Читается только словарь /Pages, на который ссылается трейлер файла;
+    дерево страниц не обходится.
+    """
+    import PyPDF2
+    with open(pdf_path, 'rb') as pdf_file:
+        reader = PyPDF2.PdfFileReader(pdf_file, strict=False)
+        try:
+            return int(reader.trailer['/Root']['/Pages']['/Count'])
+        except (KeyError, TypeError, ValueError):
+            return reader.getNumPages()
+
+
+_log_pages_re = re.compile(rb'Output written on .*?\((\d+) pages?',
+                           flags=re.DOTALL)
+_aux_pages_re = re.compile(
+    r'\\newlabel\{tvim@lastpage\}\{\{[^}]*\}\{(\d+)\}')
+
+
+def _log_page_count(log_path):
+    # сообщение о выходном файле находится в конце журнала; pdflatex
+    # переносит длинные строки, поэтому переводы строк удаляются
+    with open(log_path, 'rb') as f:
+        f.seek(max(os.fstat(f.fileno()).st_size - 65536, 0))
+        tail = f.read().replace(b'\n', b'')
+    matches = _log_pages_re.findall(tail)
+    return int(matches[-1]) if matches else None
+
+
+def _aux_page_count(aux_path):
+    # метка tvim@lastpage записывается в конце tvim_main.tex
+    with open(aux_path, 'rt') as f:
+        m = _aux_pages_re.search(f.read())
+    return int(m[1]) if m else None
+
+
+def typeset_page_count(jobname):
+    """
+    Количество страниц PDF файла, сверстанного pdflatex.
+
+    Количество берется из сообщения "Output written ... (N pages)" в .log
+    файле, затем из метки tvim@lastpage в .aux файле. Файлы, записанные
+    раньше PDF файла (например, после неудачного прохода), не учитываются.
+    Если ни один из них не подошел, читается сам PDF файл.
+    """
+    pdf_path = jobname + '.pdf'
+    pdf_mtime = os.stat(pdf_path).st_mtime_ns
+    for path, read_count in ((jobname + '.log', _log_page_count),
+                             (jobname + '.aux', _aux_page_count)):
+        try:
+            if os.stat(path).st_mtime_ns < pdf_mtime:
+                continue
+            count = read_count(path)
+        except (OSError, ValueError):
+            continue
+        if count is not None:
+            return count
+    return pdf_page_count(pdf_path)
+
+
+def merge_pdf(pdf_files, output_path):
+    """
+    Объединить PDF файлы в один.
+    """
+    import PyPDF2
+    merger = PyPDF2.PdfFileMerger()
+    for pdf_path in pdf_files:
+        merger.append(pdf_path)
+    with open(output_path, 'wb') as f:
+        merger.write(f)
+    merger.close()
+
+
+def extract_offprints(task):
+    """
+    Записать оттиски статей (отдельные PDF файлы) из PDF файла выпуска.
+
+    PDF файл открывается и разбирается один раз для всех оттисков задачи:
+    страницы и общие для статей объекты (шрифты, изображения) читаются из
+    него однажды и используются во всех оттисках. Вынесено на уровень
+    модуля для пула процессов.
+
+    Parameters
+    ----------
+        task: tuple
+            Путь к PDF файлу выпуска и список оттисков: путь к файлу,
+            индексы первой и последней страницы (с 0)
+
+    Returns
+    -------
+        list
+            Пути к записанным файлам
+    """
+    import PyPDF2
+    pdf_path, offprints = task
+    written = []
+    with open(pdf_path, 'rb') as pdf_file:
+        reader = PyPDF2.PdfFileReader(pdf_file, strict=False)
+        for output_path, first, last in offprints:
+            writer = PyPDF2.PdfFileWriter()
+            for i in range(first, last + 1):
+                writer.addPage(reader.getPage(i))
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(output_path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    writer.write(f)
+                os.replace(tmp_path, output_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            written.append(output_path)
+    return written
+
+
+def _cpu_time():
+    """
+    Процессорное время текущего процесса и завершившихся дочерних
+    процессов (pdflatex).
+    """
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class BuildProfiler:
+    """
+    Замеры времени этапов сборки выпуска.
+
+    Для каждого этапа запоминается реальное и процессорное время, для каждой
+    статьи - время компиляции и объем исходного текста. При необходимости
+    сборка профилируется с помощью cProfile.
+    """
+    def __init__(self, cprofile=False):
+        self.phases = []
+        self.articles = []
+        self.profile = cProfile.Profile() if cprofile else None
+        self._start = (time.perf_counter(), _cpu_time())
+
+    def record(self, name, wall, cpu=None):
+        self.phases.append({'name': name, 'wall': wall, 'cpu': cpu})
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Замерить время выполнения блока with.
+        """
+        wall, cpu = time.perf_counter(), _cpu_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, _cpu_time() - cpu)
+
+    def record_article(self, article, wall, cpu, cached=False):
+        self.articles.append({'path': article.path,
+                              'size': len(article.text or ''),
+                              'cached': cached,
+                              'wall': wall,
+                              'cpu': cpu})
+
+    def report(self):
+        return {
+            'wall': time.perf_counter() - self._start[0],
+            'cpu': _cpu_time() - self._start[1],
+            'phases': self.phases,
+            'article_timings': sorted(self.articles,
+                                      key=lambda a: -a['wall']),
+        }
+
+    def dump(self, path, **info):
+        """
+        Сохранить отчет в JSON файл path, а результаты cProfile (если
+        профилирование включено) - в файл с расширением .prof. Отчет не
+        должен совпадать по имени и полям с JSON файлом выпуска, иначе
+        tvim_export.py и tvim_index.py примут его за выпуск.
+        Дополнительные поля отчета (год, номер выпуска) передаются в info.
+        """
+        report = dict(info, **self.report())
+        with open(path, 'wt') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        if self.profile:
+            self.profile.dump_stats(os.path.splitext(path)[0] + '.prof')
+
+    def print_summary(self, limit=5):
+        report = self.report()
+        print('Время сборки: {:.2f} с (процессорное {:.2f} с)'.format(
+            report['wall'], report['cpu']))
+        for phase in self.phases:
+            cpu = '' if phase['cpu'] is None \
+                else ' (процессорное {:.2f} с)'.format(phase['cpu'])
+            print('  {:<30} {:8.2f} с{}'.format(phase['name'], phase['wall'],
+                                                cpu))
+        if report['article_timings']:
+            print('Самые долгие статьи:')
+            for art in report['article_timings'][:limit]:
+                print('  {:<30} {:8.2f} с, {} символов{}'.format(
+                    art['path'], art['wall'], art['size'],
+                    ' (кэш)' if art['cached'] else ''))
+
+
+class TreeWatcher:
+    """
+    Наблюдение за изменениями файлов в каталогах.
+
+    Если установлен пакет inotify_simple, используется inotify, иначе
+    каталоги периодически опрашиваются (сравниваются размеры и время
+    изменения файлов). Скрытые и резервные файлы редакторов (`.*`, `*~`)
+    не учитываются.
+    """
+    def __init__(self, paths, poll_interval=1.0):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.poll_interval = poll_interval
+        try:
+            import inotify_simple
+        except ImportError:
+            inotify_simple = None
+        self._inotify = None
+        self._watches = {}
+        if inotify_simple:
+            self._flags = inotify_simple.flags
+            self._inotify = inotify_simple.INotify()
+            for path in self.paths:
+                self._add_watches(path)
+        else:
+            self._snapshot = self._scan()
+
+    @staticmethod
+    def _ignored(name):
+        return name.startswith('.') or name.endswith('~')
+
+    def _add_watches(self, path):
+        flags = self._flags
+        mask = flags.CLOSE_WRITE | flags.MODIFY | flags.CREATE \
+            | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+        added = []
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not self._ignored(d)]
+            self._watches[self._inotify.add_watch(root, mask)] = root
+            added.extend(os.path.join(root, f) for f in files)
+        return added
+
+    def _scan(self):
+        snapshot = {}
+        for path in self.paths:
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not self._ignored(d)]
+                for name in files:
+                    if self._ignored(name):
+                        continue
+                    file_path = os.path.join(root, name)
+                    try:
+                        st = os.stat(file_path)
+                    except OSError:
+                        continue
+                    snapshot[file_path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def _read_inotify(self, timeout):
+        changed = set()
+        events = self._inotify.read(
+            timeout=None if timeout is None else int(timeout * 1000))
+        for event in events:
+            if event.mask & self._flags.IGNORED:
+                self._watches.pop(event.wd, None)
+                continue
+            root = self._watches.get(event.wd)
+            if root is None or self._ignored(event.name):
+                continue
+            path = os.path.join(root, event.name)
+            changed.add(path)
+            # в новом каталоге могли появиться файлы до установки watch
+            if event.mask & self._flags.ISDIR and event.mask \
+                    & (self._flags.CREATE | self._flags.MOVED_TO):
+                changed.update(self._add_watches(path))
+        return changed
+
+    def _read_polling(self, timeout):
+        start = time.monotonic()
+        while True:
+            delay = self.poll_interval if timeout is None \
+                else min(self.poll_interval, timeout)
+            time.sleep(delay)
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self._snapshot
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed or timeout is not None \
+                    and time.monotonic() - start >= timeout:
+                return changed
+
+    def _read(self, timeout):
+        if self._inotify:
+            return self._read_inotify(timeout)
+        return self._read_polling(timeout)
+
+    def wait(self, debounce=0.5):
+        """
+        Дождаться изменений. Серия изменений, между которыми проходит
+        меньше debounce секунд, возвращается одним множеством путей.
+        """
+        changed = set()
+        while not changed:
+            changed = self._read(None)
+        while True:
+            more = self._read(debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+
+
+def article_task(workspace, path):
+    """
+    Задача компиляции статьи (см. _compile_article) по имени ее каталога:
+    каталоги `_*` подключаются без изменений, суффиксы `_en` и `_ukr`
+    задают язык статьи.
+    """
+    name = os.path.basename(path)
+    if name.startswith('_'):
+        return VerbatimArticle, workspace, path
+    if name.endswith('_en'):
+        lang = 'eng'
+    elif name.endswith('_ukr'):
+        lang = 'ukr'
+    else:
+        lang = 'rus'
+    return Article, workspace, path, lang
+
+
+def _compile_article(task):
+    """
+    Создать и скомпилировать статью. Вынесено на уровень модуля, чтобы
+    функцию можно было выполнять в пуле процессов.
+
+    Parameters
+    ----------
+        task: tuple
+            Класс статьи, рабочий каталог выпуска, путь к каталогу статьи
+            относительно него и остальные аргументы конструктора
+
+    Returns
+    -------
+        tuple
+            Статья, реальное и процессорное время компиляции
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    article_cls, root, path, *args = task
+    article = article_cls(path, *args, root=root)
+    article.compile()
+    return article, time.perf_counter() - wall, time.process_time() - cpu
+
+
+class _RecordCollector(logging.Handler):
+    """
+    Собирает сообщения логгера tvim (например, при разборе статьи).
+    """
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _check_article(task):
+    """
+    Проверить статью (см. Article.check). Вынесено на уровень модуля для
+    пула процессов.
+
+    Returns
+    -------
+        dict
+            Путь к статье и замечания; сообщения, записанные в лог при
+            разборе статьи, тоже включаются в замечания
+    """
+    article_cls, root, path, *args = task
+    collector = _RecordCollector()
+    logger.addHandler(collector)
+    try:
+        # extract_sections печатает найденные разделы
+        with open(os.devnull, 'wt') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            article = article_cls(path, *args, root=root)
+            problems = article.check()
+    except Exception as e:
+        problems = [{'level': 'error', 'line': None,
+                     'message': 'Ошибка разбора статьи: {}: {}'.format(
+                         type(e).__name__, e)}]
+    finally:
+        logger.removeHandler(collector)
+    logged = [{'level': 'error' if r.levelno >= logging.ERROR else 'warning',
+               'line': None, 'message': r.getMessage()}
+              for r in collector.records]
+    return {'article': path, 'problems': logged + problems}
+
+
 class TvimDocument:
     """
     Объектная модель выпуска журнала.
+
+    Пути из конфигурации и рабочий каталог выпуска приводятся к абсолютным
+    при создании объекта, все файлы сборки открываются по полным путям, а
+    pdflatex запускается с cwd= рабочего каталога. Текущий каталог процесса
+    не меняется, поэтому разные выпуски можно собирать одновременно в
+    потоках одного процесса.
     """
-    def __init__(self, config):
+    # номер первой страницы статей, задается в tvim_main.tex
+    first_page = 6
+    # файлы ресурсов, которые компилятор переписывает или дополняет
+    rewritten_files = ('tvim_main.tex', 'articles.tex', 'referats.tex',
+                       'authors.tex')
+
+    def __init__(self, config, jobs=1, use_cache=True, max_passes=4,
+                 split=False, use_format=True, profile=False,
+                 use_figures=True, offprints=False, need_pages=False):
         self.config = config
+        self.profiler = BuildProfiler(cprofile=profile)
+        self.jobs = jobs
+        self.max_passes = max_passes
+        self.split = split
+        self.passes = []
+        self.parts = []
         self.articles = []
         self.verbatim_articles = []
+        self.offprints = offprints
+        # страницы статей нужны для экспорта метаданных; без этого и без
+        # оттисков они пишутся в JSON, если определены, но отсутствие
+        # меток не считается ошибкой
+        self.need_pages = need_pages or offprints
+        # страницы статей в выпуске по каталогам статей (см. _article_pages)
+        self.article_pages = {}
+        # скомпилированные статьи по задачам компиляции, используются
+        # повторно в режиме наблюдения (см. watch)
+        self._compiled = {}
         # parameters
         self.year = self.config['tvim']['year']
         self.number = self.config['tvim']['number']
@@ -503,24 +2203,60 @@ class TvimDocument:
         self.protocol_monthname = self.config['tvim'].get('protocol month name',
                                                           '???')
         self.protocol_year = self.config['tvim'].get('protocol year', '???')
-        self.resources = self.config['path']['resources']
+        self.resources = os.path.abspath(self.config['path']['resources'])
+        self.articles_source = os.path.abspath(
+            self.config['path']['articles'])
         self.page_count = 0
 
-        self.root_path = 'numbers/tvim_{}_{}'.format(self.year, self.number)
+        self.root_path = os.path.abspath(
+            os.path.join('numbers', 'tvim_{}_{}'.format(self.year,
+                                                        self.number)))
+        self.jobname = 'tvim_{}_{}'.format(self.year, self.number)
+        self.cache = None
+        if use_cache:
+            cache_path = self.config['path'].get(
+                'cache', os.path.join('numbers', '.cache',
+                                      'tvim_{}_{}'.format(self.year,
+                                                          self.number)))
+            self.cache = BuildCache(os.path.abspath(cache_path))
+        self.format_cache = None
+        self.fmt = None
+        if use_format:
+            format_path = self.config['path'].get(
+                'formats', os.path.join('numbers', '.cache', 'formats'))
+            self.format_cache = FormatCache(os.path.abspath(format_path))
+        self.figure_cache = None
+        if use_figures:
+            figures_path = self.config['path'].get(
+                'figures', os.path.join('numbers', '.cache', 'figures'))
+            self.figure_cache = FigureCache(
+                os.path.abspath(figures_path),
+                dpi=self.config['tvim'].get('figure dpi'))
 
     @classmethod
-    def from_config(cls, path):
+    def from_config(cls, path, **kwargs):
         """
         Parameters
         ----------
             path: str
                 Путь к конфигурационному файлу
+            kwargs:
+                Параметры сборки, передаются в конструктор (jobs, use_cache,
+                max_passes, split, use_format, profile, use_figures,
+                offprints, need_pages)
         """
+        import yaml
         with open(path, 'rt') as config_file:
             config = yaml.load(config_file, Loader=yaml.SafeLoader)
-        return cls(config)
+        return cls(config, **kwargs)
 
     art_number = property(lambda self: len(self.articles), None, None)
+    # рабочий каталог выпуска; все файлы сборки читаются и записываются
+    # по полным путям, текущий каталог процесса не меняется
+    workspace = property(lambda self: os.path.abspath(self.root_path))
+
+    def _path(self, *names):
+        return os.path.join(self.workspace, *names)
 
     def _update_params(self):
         """
@@ -550,7 +2286,7 @@ class TvimDocument:
             r'\newlength{\myinter}''\n'
         ]
 
-        with open('__params__.tex', 'wt') as f:
+        with open(self._path('__params__.tex'), 'wt') as f:
             f.writelines(params)
 
         # обновление параметров на английском языке
@@ -577,7 +2313,7 @@ class TvimDocument:
             r'\def\kfmnen{candidate of Physico-Mathematical Sciences}''\n',
         ]
 
-        with open('__params_en__.tex', 'wt') as f:
+        with open(self._path('__params_en__.tex'), 'wt') as f:
             f.writelines(params)
 
     @staticmethod
@@ -604,10 +2340,50 @@ class TvimDocument:
                                abstract_ru=article.abstracts['ru'],
                                keywords_ru=article.keywords['ru'])
 
-    def _build(self):
-        articles_path = os.path.join('articles')
+    def _prepare_figures(self):
+        """
+        Преобразовать EPS изображения статей в PDF и уменьшить большие
+        растровые изображения (см. FigureCache).
+
+        Проверяются изображения всех статей, а не только измененных:
+        синхронизация рабочего каталога могла вернуть исходный файл на место
+        уменьшенного, а повторная подготовка берет результат из кэша.
+        """
+        articles_path = self._path('articles')
+        tasks = [(self.figure_cache, os.path.join(articles_path, art))
+                 for art in sorted(os.listdir(articles_path))
+                 if not art.startswith(('.', '-', '_'))
+                 and os.path.isdir(os.path.join(articles_path, art))]
+        if self.jobs > 1 and len(tasks) > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(self.jobs) as executor:
+                results = list(executor.map(_prepare_figures, tasks))
+        else:
+            results = [_prepare_figures(task) for task in tasks]
+
+        prepared = [figure for figures in results for figure in figures]
+        if prepared:
+            eps = sum(action == 'eps' for _, action, _, _ in prepared)
+            print('Изображения: преобразовано EPS {}, уменьшено {}, '
+                  '{:.1f} МБ -> {:.1f} МБ'.format(
+                      eps, len(prepared) - eps,
+                      sum(f[2] for f in prepared) / 2 ** 20,
+                      sum(f[3] for f in prepared) / 2 ** 20))
+
+    def _build(self, changed=None):
+        """
+        Скомпилировать статьи и сформировать articles.tex, referats.tex и
+        authors.tex.
+
+        Parameters
+        ----------
+            changed: set или None
+                Имена измененных каталогов статей. Если задано, остальные
+                статьи берутся из памяти без проверки кэша.
+        """
+        articles_path = 'articles'
         articles = [
-            f for f in os.listdir(articles_path)
+            f for f in os.listdir(self._path(articles_path))
             if not f.startswith('.') and not f.startswith('-')
         ]
 
@@ -615,23 +2391,54 @@ class TvimDocument:
         self.articles = []
         author_details = []
 
-        for art in articles:
-            art_path = os.path.join(articles_path, art)
-            article = None
-            if art.startswith('_'):
-                article = VerbatimArticle(art_path)
+        tasks = [article_task(self.workspace, os.path.join(articles_path, art))
+                 for art in articles]
+
+        # неизмененные статьи берем из памяти или из кэша
+        compiled = [None] * len(tasks)
+        keys = [None] * len(tasks)
+        if changed is not None:
+            for i, task in enumerate(tasks):
+                if os.path.basename(task[2]) not in changed:
+                    compiled[i] = self._compiled.get(task)
+                    if compiled[i]:
+                        self.profiler.record_article(compiled[i], 0, 0,
+                                                     cached=True)
+        if self.cache:
+            for i, task in enumerate(tasks):
+                if compiled[i]:
+                    continue
+                wall, cpu = time.perf_counter(), time.process_time()
+                keys[i] = self.cache.key(task)
+                compiled[i] = self.cache.load(task, keys[i])
+                if compiled[i]:
+                    self.profiler.record_article(
+                        compiled[i], time.perf_counter() - wall,
+                        time.process_time() - cpu, cached=True)
+        pending = [i for i, article in enumerate(compiled) if article is None]
+        pending_tasks = [tasks[i] for i in pending]
+
+        # статьи компилируются независимо друг от друга, поэтому их можно
+        # обрабатывать параллельно; map сохраняет исходный порядок
+        if self.jobs > 1 and len(pending_tasks) > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(self.jobs) as executor:
+                results = list(executor.map(_compile_article, pending_tasks))
+        else:
+            results = [_compile_article(task) for task in pending_tasks]
+
+        for i, (article, wall, cpu) in zip(pending, results):
+            self.profiler.record_article(article, wall, cpu)
+            compiled[i] = article
+            if self.cache:
+                self.cache.store(tasks[i], keys[i], article)
+
+        self._compiled = dict(zip(tasks, compiled))
+        for article in compiled:
+            if isinstance(article, VerbatimArticle):
                 self.verbatim_articles.append(article)
-            elif not art.startswith('-'):
-                if art.endswith('_en'):
-                    lang = 'eng'
-                elif art.endswith('_ukr'):
-                    lang = 'ukr'
-                else:
-                    lang = 'rus'
-                article = Article(art_path, lang)
+            else:
                 self.articles.append(article)
-            if article:
-                article.compile()
 
         self.articles = sorted(self.articles, key=lambda a: a.authors_str)
 
@@ -640,86 +2447,572 @@ class TvimDocument:
         narticles = len(self.articles)
         # collecting verbatim articles
         for i, art in enumerate(self.verbatim_articles):
-            art_file_content.append(art.art_path)
+            art_file_content.append(art.tex_path)
 
         # collecting scientific articles
         for i, art in enumerate(self.articles):
             author_details.extend(art.author_details)
-            if art.art_path:
-                art_file_content.append(art.art_path)
+            if art.tex_path:
+                art_file_content.append(art.tex_path)
                 referats.append(self._get_referat(art, i < narticles - 1))
 
-        with open('articles.tex', 'wt') as f:
+        self.parts = art_file_content
+        with open(self._path('articles.tex'), 'wt') as f:
             f.writelines([r'\input{{{}}}''\n'.format(art_path)
                           for art_path in art_file_content])
 
         author_details = sorted(author_details)
-        with open('authors.tex', 'at') as authors_file:
+        with open(self._path('authors.tex'), 'at') as authors_file:
             authors_file.writelines('\n\n'r'\medskip''\n'.join(author_details))
 
-        with open('referats.tex', 'at') as referats_file:
+        with open(self._path('referats.tex'), 'at') as referats_file:
             referats_file.writelines('\n\n'.join(referats))
 
-    def calc_page_count(self, pdf_path):
-        self.page_count = 0
-        with open(pdf_path, 'rb') as pdf_file:
-            reader = PyPDF2.PdfFileReader(pdf_file)
-            self.page_count = reader.getNumPages()
+    def calc_page_count(self, jobname):
+        self.page_count = typeset_page_count(self._path(jobname))
 
-    def compile(self):
+    def _typeset(self, jobname):
+        """
+        Сверстать выпуск целиком. После каждого прохода pdflatex
+        пересчитывается количество страниц и обновляются параметры выпуска.
+
+        Returns
+        -------
+            bool
+                True, если все проходы завершились успешно
+        """
+        def after_pass():
+            with self.profiler.phase('calc_page_count'):
+                self.calc_page_count(jobname)
+            self._update_params()
+
+        ok, self.passes = run_pdflatex(
+            jobname, max_passes=self.max_passes, after_pass=after_pass,
+            fmt=self.fmt, cwd=self.workspace,
+            monitor=self._pdflatex_monitor(jobname, self.page_count))
+        for i, duration in enumerate(self.passes):
+            self.profiler.record('pdflatex {}'.format(i + 1), duration)
+            print('Проход pdflatex {}: {:.1f} с'.format(i + 1, duration))
+        if ok:
+            print('Выполнено проходов pdflatex: {}, '
+                  'общее время {:.1f} с'.format(len(self.passes),
+                                                sum(self.passes)))
+        return ok
+
+    def _typeset_part(self, part, jobname, first_page, articles_file=''):
+        """
+        Сверстать часть выпуска отдельным заданием pdflatex.
+
+        Parameters
+        ----------
+            part: str
+                Имя части: `article`, `front` или `back`
+            jobname: str
+                Имя задания pdflatex (имена .pdf, .aux и .log файлов)
+            first_page: int
+                Номер первой страницы части
+            articles_file: str
+                Файл, подключаемый вместо articles.tex
+        """
+        max_passes = 1 if part == 'front' else self.max_passes
+        return run_pdflatex(jobname,
+                            self._part_source(part, first_page,
+                                              articles_file),
+                            max_passes=max_passes, fmt=self.fmt,
+                            cwd=self.workspace,
+                            monitor=self._pdflatex_monitor(jobname))
+
+    def _pdflatex_monitor(self, jobname, expected_pages=None):
+        """
+        Монитор вывода pdflatex (см. PdflatexMonitor), который относит
+        ошибки к статьям выпуска.
+        """
+        articles = {}
+        labels = {}
+        for article in self.verbatim_articles:
+            articles[article.path] = None
+        for article in self.articles:
+            articles[article.path] = ', '.join(
+                '{} {} {}'.format(a['family'], a['name'], a['patronymic'])
+                for a in article.authors)
+            labels[article.begin_label] = article.path
+        return PdflatexMonitor(articles, labels,
+                               aux_path=self._path(jobname + '.aux'),
+                               expected_pages=expected_pages or None)
+
+    def _part_source(self, part, first_page, articles_file=''):
+        """
+        Исходный код TeX для верстки части выпуска (см. _typeset_part).
+        """
+        template = '\\def\\tvimfront{{{front}}}' \
+                   '\\def\\tvimback{{{back}}}' \
+                   '\\def\\tvimarticlesfile{{{articles}}}' \
+                   '\\def\\tvimfirstpage{{{page}}}' \
+                   '\\input{{{main}}}'
+        return template.format(front=int(part == 'front'),
+                               back=int(part == 'back'),
+                               articles=articles_file, page=first_page,
+                               main=self.jobname)
+
+    @staticmethod
+    def _read_aux(jobname):
+        """
+        Метки (\\newlabel) и строки содержания (\\@writefile) из .aux файла
+        отдельно сверстанной части выпуска. jobname - путь к файлам задания
+        без расширения.
+        """
+        labels = []
+        contents = collections.defaultdict(list)
+        try:
+            with open(jobname + '.aux', 'rt') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return labels, contents
+        scanner = LatexScanner(''.join(lines))
+        for token in scanner.commands('newlabel'):
+            args = scanner.arguments(token.end, 2)
+            # служебные метки (количество страниц, первая страница статей)
+            # у каждой части свои
+            if len(args) == 2 and not args[0][0].startswith('tvim@'):
+                labels.append(scanner.text[token.start:args[1][2]])
+        for token in scanner.commands('@writefile'):
+            args = scanner.arguments(token.end, 2)
+            if len(args) == 2:
+                contents[args[0][0]].append(args[1][0])
+        return labels, contents
+
+    def _typeset_split(self):
+        """
+        Раздельная верстка выпуска. Каждая статья верстается отдельным
+        заданием pdflatex в пуле потоков, затем отдельно верстаются
+        рефераты со списком авторов и первые страницы с содержанием, после
+        чего PDF файлы частей объединяются в один.
+
+        Номер первой страницы каждой статьи зависит от объема предыдущих,
+        поэтому статьи перевёрстываются, пока номера первых страниц
+        не перестанут меняться. Статья, у которой не изменились текст и
+        номер первой страницы, повторно не верстается.
+
+        Returns
+        -------
+            bool
+                True, если все части сверстаны успешно
+        """
+        state_path = self._path('__split__.json')
+        try:
+            with open(state_path, 'rt') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+
+        h = hashlib.sha256()
+        for name in (self.jobname + '.tex', 'tvim.sty'):
+            with open(self._path(name), 'rb') as f:
+                h.update(f.read())
+        main_key = h.hexdigest()
+
+        def part_key(tex_path, first_page):
+            h = hashlib.sha256(main_key.encode())
+            with open(self._path(tex_path), 'rb') as f:
+                h.update(f.read())
+            h.update(str(first_page).encode())
+            return h.hexdigest()
+
+        def part_jobname(tex_path):
+            return '__part_{}__'.format(
+                os.path.basename(os.path.dirname(tex_path)))
+
+        def typeset_article(task):
+            tex_path, first_page = task
+            jobname = part_jobname(tex_path)
+            ok, passes = self._typeset_part('article', jobname, first_page,
+                                            os.path.splitext(tex_path)[0])
+            pages = typeset_page_count(self._path(jobname)) if ok else 0
+            return tex_path, first_page, ok, passes, pages
+
+        first_page = self.first_page
+        for _ in range(self.max_passes):
+            todo = []
+            page = first_page
+            for tex_path in self.parts:
+                entry = state.get(tex_path, {})
+                if entry.get('key') != part_key(tex_path, page) \
+                        or not os.path.exists(
+                            self._path(part_jobname(tex_path) + '.pdf')):
+                    todo.append((tex_path, page))
+                page += entry.get('pages', 1)
+            if not todo:
+                break
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+                results = list(executor.map(typeset_article, todo))
+            for tex_path, page, ok, passes, pages in results:
+                if not ok:
+                    print('ОШИБКА: не удалось сверстать {}. Посмотрите, '
+                          'пожалуйста, {}.log'.format(tex_path,
+                                                      part_jobname(tex_path)))
+                    return False
+                self.profiler.record('pdflatex ' + part_jobname(tex_path),
+                                     sum(passes))
+                print('Статья {} (с. {}--{}): проходов pdflatex {}, '
+                      '{:.1f} с'.format(tex_path, page, page + pages - 1,
+                                        len(passes), sum(passes)))
+                state[tex_path] = {'key': part_key(tex_path, page),
+                                   'pages': pages}
+            with open(state_path, 'wt') as f:
+                json.dump(state, f, indent=4)
+        else:
+            logger.warning('Номера страниц статей не установились '
+                           'за {} итераций'.format(self.max_passes))
+
+        labels = []
+        contents = collections.defaultdict(list)
+        for tex_path in self.parts:
+            part_labels, part_contents = self._read_aux(
+                self._path(part_jobname(tex_path)))
+            labels.extend(part_labels)
+            for name, lines in part_contents.items():
+                contents[name].extend(lines)
+        back_page = first_page + sum(state[p]['pages'] for p in self.parts)
+
+        # рефераты и список авторов ссылаются на страницы статей, метки
+        # статей подключаются вместо articles.tex
+        with open(self._path('__labels__.tex'), 'wt') as f:
+            f.write('\\makeatletter\n{}\n\\makeatother\n'.format(
+                '\n'.join(labels)))
+
+        pdf_files = None
+        for _ in range(self.max_passes):
+            ok, passes = self._typeset_part('back', '__part_back__',
+                                            back_page, '__labels__')
+            if not ok:
+                print('ОШИБКА: не удалось сверстать рефераты. '
+                      'Посмотрите, пожалуйста, __part_back__.log')
+                return False
+            _, back_contents = self._read_aux(self._path('__part_back__'))
+
+            # содержание первых страниц собирается из .aux файлов частей
+            for name in ('toc', 'tec'):
+                with open(self._path('__part_front__.' + name), 'wt') as f:
+                    f.writelines(line + '\n' for line in
+                                 contents[name] + back_contents[name])
+            ok, passes = self._typeset_part('front', '__part_front__',
+                                            first_page)
+            if not ok:
+                print('ОШИБКА: не удалось сверстать первые страницы. '
+                      'Посмотрите, пожалуйста, __part_front__.log')
+                return False
+
+            pdf_files = ['__part_front__.pdf'] + \
+                [part_jobname(p) + '.pdf' for p in self.parts] + \
+                ['__part_back__.pdf']
+            merge_pdf([self._path(f) for f in pdf_files],
+                      self._path(self.jobname + '.pdf'))
+            self.calc_page_count(self.jobname)
+            # объем выпуска указывается на последней странице
+            with open(self._path('__params__.tex'), 'rb') as f:
+                params = f.read()
+            self._update_params()
+            with open(self._path('__params__.tex'), 'rb') as f:
+                if f.read() == params:
+                    break
+        print('Выпуск собран из {} частей'.format(len(pdf_files)))
+        return True
+
+    def _article_pages(self):
+        """
+        Страницы статей выпуска по меткам `<id>_begin` и `<id>_end`.
+
+        Метки tvim@firstpage и tvim@firstpdfpage из tvim_main.tex задают
+        номер страницы, с которой начинаются статьи, и ее номер в PDF
+        файле выпуска. При раздельной верстке метки статей берутся из
+        __labels__.tex, а статьи в PDF файле следуют за первыми страницами.
+
+        Если страницы не нужны для оттисков или экспорта (need_pages),
+        отсутствие меток не выводится как предупреждение.
+
+        Returns
+        -------
+            dict
+                Номера первой и последней страницы статьи и индексы этих
+                страниц в PDF файле выпуска (с 0) по каталогам статей
+        """
+        level = logging.WARNING if self.need_pages else logging.DEBUG
+        if self.split:
+            pages = aux_label_pages(self._path('__labels__.tex'))
+            offset = typeset_page_count(self._path('__part_front__')) \
+                - self.first_page
+        else:
+            pages = aux_label_pages(self._path(self.jobname + '.aux'))
+            if 'tvim@firstpdfpage' not in pages:
+                logger.log(level, 'В .aux файле нет метки tvim@firstpdfpage, '
+                           'страницы статей не определены')
+                return {}
+            offset = pages['tvim@firstpdfpage'] - 1 - pages['tvim@firstpage']
+        result = {}
+        for article in self.articles:
+            begin = pages.get(article.begin_label)
+            end = pages.get(article.end_label)
+            if begin is None or end is None or end < begin:
+                logger.log(level, 'Не найдены страницы статьи {}'.format(
+                    article.path))
+                continue
+            result[article.path] = (begin, end, begin + offset, end + offset)
+        return result
+
+    def _offprint_name(self, path):
+        return '{}_{}.pdf'.format(self.jobname, os.path.basename(path))
+
+    def _write_offprints(self):
+        """
+        Записать оттиски статей в каталог offprints рабочего каталога
+        выпуска. PDF файл выпуска открывается один раз в каждом процессе
+        пула (см. extract_offprints), статьи распределяются между
+        процессами поровну.
+        """
+        offprints_path = self._path('offprints')
+        shutil.rmtree(offprints_path, ignore_errors=True)
+        os.makedirs(offprints_path)
+        offprints = []
+        for article in self.articles:
+            pages = self.article_pages.get(article.path)
+            if pages:
+                offprints.append((os.path.join(
+                    offprints_path, self._offprint_name(article.path)),
+                    pages[2], pages[3]))
+        if not offprints:
+            return
+        pdf_path = self._path(self.jobname + '.pdf')
+        workers = min(self.jobs, len(offprints))
+        # соседние статьи в одной задаче: у них больше общих объектов
+        size = -(-len(offprints) // workers)
+        tasks = [(pdf_path, offprints[i:i + size])
+                 for i in range(0, len(offprints), size)]
+        if workers > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                written = sum(executor.map(extract_offprints, tasks), [])
+        else:
+            written = sum(map(extract_offprints, tasks), [])
+        print('Оттиски статей: {} в {}'.format(len(written), offprints_path))
+
+    def compile(self, changed=None):
+        """
+        Собрать выпуск.
+
+        Parameters
+        ----------
+            changed: set или None
+                Имена измененных каталогов статей (см. _build)
+
+        Returns
+        -------
+            bool
+                True, если выпуск собран успешно
+        """
         print('Компиляция ТВИМ {year} №{number}. '
               'Пожалуйста подождите'.format(year=self.year,
                                             number=self.number))
-        # задаем корневую папку и копируем необходимые файлы
-        # для компиляции журнала
-        if os.path.exists(self.root_path):
-            shutil.rmtree(self.root_path)
-        shutil.copytree(self.resources, self.root_path)
-        shutil.copytree(self.config['path']['articles'],
-                        os.path.join(self.root_path, 'articles'))
-
-        cur_dir = os.path.abspath(os.path.curdir)
+        profiler = self.profiler
         try:
-            os.chdir(self.root_path)
-            main_filename = 'tvim_{}_{}.tex'.format(self.year, self.number)
-            os.rename('tvim_main.tex', main_filename)
+            if profiler.profile:
+                profiler.profile.enable()
+            # задаем корневую папку и размещаем в ней необходимые файлы
+            # для компиляции журнала; при повторной сборке обновляются
+            # только измененные файлы, неизменяемые связываются ссылками
+            with profiler.phase('staging'):
+                sync_tree(self.resources, self.workspace,
+                          materialize=self.rewritten_files)
+                sync_tree(self.articles_source, self._path('articles'),
+                          prune=True)
+            jobname = self.jobname
+            os.replace(self._path('tvim_main.tex'),
+                       self._path(jobname + '.tex'))
+            # при повторной сборке берем количество страниц из предыдущей,
+            # чтобы не тратить лишний проход pdflatex на его уточнение
+            if os.path.exists(self._path(jobname + '.pdf')):
+                with profiler.phase('calc_page_count'):
+                    self.calc_page_count(jobname)
             self._update_params()
-            self._build()
-            cmd = ['pdflatex', '-halt-on-error', '-file-line-error',
-                   'tvim_{}_{}.tex'.format(self.year, self.number)]
-            res = subprocess.run(cmd, stdout=subprocess.PIPE)
-            if res.returncode == 0:
-                self.calc_page_count('tvim_{}_{}.pdf'.format(self.year,
-                                                             self.number))
-                self._update_params()
-                # второй запуск для создания ссылок и содержания
-                subprocess.run(cmd, stdout=subprocess.PIPE)
+            if self.figure_cache:
+                with profiler.phase('figures'):
+                    self._prepare_figures()
+            with profiler.phase('build'):
+                self._build(changed)
+            if self.format_cache:
+                with profiler.phase('format'):
+                    self.fmt = self.format_cache.prepare(
+                        jobname + '.tex', cwd=self.workspace)
+            with profiler.phase('typeset'):
+                ok = self._typeset_split() if self.split \
+                    else self._typeset(jobname)
+            if ok:
                 print(f'ТВИМ {self.year} {self.number} успешно собран')
-                with open(f'tvim_{self.year}_{self.number}.json', 'wt') \
-                        as json_file:
+                with profiler.phase('offprints'):
+                    self.article_pages = self._article_pages()
+                    if self.offprints:
+                        self._write_offprints()
+                with open(self._path(f'tvim_{self.year}_{self.number}.json'),
+                          'wt') as json_file:
                     json.dump(self.as_dict(), json_file, indent=4,
                               sort_keys=False, ensure_ascii=False)
             else:
                 print('ОШИБКА: что-то пошло не так. '
                       'Посмотрите, пожалуйста, лог файл.')
+            return ok
         finally:
-            os.chdir(cur_dir)
+            if profiler.profile:
+                profiler.profile.disable()
 
-    def as_dict(self):
+    def watch(self, debounce=0.5, poll_interval=1.0):
+        """
+        Собрать выпуск и пересобирать его при изменении статей и ресурсов,
+        пока процесс не будет прерван (Ctrl+C).
+
+        Повторно компилируются только статьи из измененных каталогов,
+        остальные берутся из памяти. Изменения ресурсов только обновляют
+        рабочий каталог выпуска.
+        """
+        articles_path = self.articles_source
+        watcher = TreeWatcher([articles_path, self.resources], poll_interval)
+        # None - полная сборка
+        changed = None
+        try:
+            while True:
+                try:
+                    self.compile(changed)
+                    changed = set()
+                except Exception:
+                    # статьи, измененные с последней успешной сборки,
+                    # будут скомпилированы повторно
+                    logger.exception('Не удалось собрать выпуск')
+                print('Ожидание изменений (Ctrl+C - выход)...')
+                modified = set()
+                for path in watcher.wait(debounce):
+                    rel_path = os.path.relpath(path, articles_path)
+                    if not rel_path.startswith(os.pardir):
+                        modified.add(rel_path.split(os.sep)[0])
+                if modified:
+                    print('Изменены статьи: {}'.format(
+                        ', '.join(sorted(modified))))
+                else:
+                    print('Изменены ресурсы выпуска')
+                if changed is not None:
+                    changed |= modified
+        except KeyboardInterrupt:
+            print('Наблюдение остановлено')
+        finally:
+            watcher.close()
+
+    def check(self, report_path=None):
+        """
+        Проверить статьи выпуска без сборки: статьи читаются прямо из
+        каталога статей, рабочий каталог и pdflatex не используются.
+        Статьи проверяются параллельно в -j процессах (по умолчанию по
+        числу процессоров).
+
+        Parameters
+        ----------
+            report_path: str или None
+                Путь к JSON файлу для отчета
+
+        Returns
+        -------
+            bool
+                True, если ошибок не найдено
+        """
+        wall = time.perf_counter()
+        articles_path = self.articles_source
+        tasks = [article_task(articles_path, name)
+                 for name in sorted(os.listdir(articles_path))
+                 if not name.startswith(('.', '-'))
+                 and os.path.isdir(os.path.join(articles_path, name))]
+        jobs = self.jobs if self.jobs > 1 else os.cpu_count() or 1
+        if jobs > 1 and len(tasks) > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(
+                    min(jobs, len(tasks))) as executor:
+                results = list(executor.map(_check_article, tasks))
+        else:
+            results = [_check_article(task) for task in tasks]
+
+        failed = 0
+        for result in results:
+            problems = result['problems']
+            errors = sum(p['level'] == 'error' for p in problems)
+            failed += errors > 0
+            print('{}: ошибок {}, предупреждений {}'.format(
+                result['article'], errors, len(problems) - errors))
+            for p in problems:
+                print('  {}{}: {}'.format(
+                    'ОШИБКА' if p['level'] == 'error' else 'Предупреждение',
+                    ' (стр. {})'.format(p['line']) if p['line'] else '',
+                    p['message']))
+        print('Проверено статей: {}, с ошибками: {} ({:.1f} с)'.format(
+            len(results), failed, time.perf_counter() - wall))
+        if report_path:
+            with open(report_path, 'wt') as report_file:
+                json.dump({'year': self.year, 'number': self.number,
+                           'articles': results}, report_file, indent=4,
+                          ensure_ascii=False)
+        return failed == 0
+
+    def as_dict(self, articles=True):
         return {
             'year': self.year,
             'number': self.number,
-            'articles': [a.as_dict() for a in self.articles]
+            'total number': self.total_number,
+            'pages': self.page_count or None,
+            'articles': [self.article_dict(a) for a in self.articles]
+            if articles else []
         }
 
+    def article_dict(self, article):
+        """
+        Описание статьи для JSON файла выпуска: Article.as_dict и страницы
+        статьи в выпуске.
+        """
+        return dict(article.as_dict(), pages=self._pages_dict(article.path))
+
+    def _pages_dict(self, path):
+        pages = self.article_pages.get(path)
+        if not pages:
+            return None
+        result = {'first': pages[0], 'last': pages[1]}
+        if self.offprints:
+            result['offprint'] = os.path.join('offprints',
+                                              self._offprint_name(path))
+        return result
+
 
 class ReportGenerator:
+    """
+    Документы выпуска (представление, заявление, экспертиза и т.д.),
+    заполненные по шаблонам .docx из каталога `path: docs` конфигурации.
+
+    Каждый документ строится методом, который получает загруженный шаблон
+    и заполняет его; документы собираются одновременно в пуле потоков и
+    записываются только в каталог docs рабочего каталога выпуска. Шаблоны
+    читаются с диска один раз на процесс и не изменяются. Новый документ
+    добавляется в documents вместе с методом build_<...>(doc).
+    """
+    # имя файла шаблона (и документа) и метод, заполняющий шаблон
+    documents = (
+        ('05predstavlen.docx', 'build_05_predstavlen'),
+        ('06zayavlenie.docx', 'build_06zayavlenie'),
+        ('Приложение1_Экспертиза публикации.docx', 'build_expertiza'),
+        ('Экспортное заключение.docx', 'build_export_doc'),
+    )
+    # содержимое шаблонов по путям вместе с временем изменения и размером
+    # файла, общее для всех выпусков процесса (см. build_issues)
+    _templates = {}
+    _templates_lock = threading.Lock()
 
     def __init__(self, tvim_doc: TvimDocument, config):
         self.config = config
-        self.template_path = config['path']['docs']
+        self.template_path = os.path.abspath(config['path']['docs'])
         self.tvim_doc = tvim_doc
-        self.root_path = os.path.join(self.tvim_doc.root_path, 'docs')
+        self.root_path = self.tvim_doc._path('docs')
 
     @classmethod
     def from_config(cls, tvim_doc: TvimDocument, path):
@@ -731,12 +3024,59 @@ class ReportGenerator:
             path: str
                 Путь к конфигурационному файлу
         """
+        import yaml
         with open(path, 'rt') as config_file:
             config = yaml.load(config_file, Loader=yaml.SafeLoader)
         return cls(tvim_doc, config)
 
-    def build_05_predstavlen(self):
-        doc = Document(os.path.join(self.root_path, '05predstavlen.docx'))
+    def load_template(self, filename):
+        """
+        Загрузить шаблон документа. Файл шаблона читается с диска только
+        при первом обращении или после его изменения.
+        """
+        from docx import Document
+        path = os.path.join(self.template_path, filename)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._templates_lock:
+            cached = self._templates.get(path)
+        if cached is None or cached[0] != stamp:
+            with open(path, 'rb') as f:
+                cached = (stamp, f.read())
+            with self._templates_lock:
+                self._templates[path] = cached
+        return Document(io.BytesIO(cached[1]))
+
+    def _save(self, doc, filename):
+        """
+        Сохранить документ в папку выпуска. Документ записывается во
+        временный файл и заменяет прежний: файл в этой папке может быть
+        ссылкой на шаблон (после прежних версий компилятора), и записывать
+        в него нельзя.
+        """
+        path = os.path.join(self.root_path, filename)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                doc.save(f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+    def build_document(self, filename, method):
+        """
+        Заполнить шаблон filename методом method и сохранить документ.
+        """
+        doc = self.load_template(filename)
+        getattr(self, method)(doc)
+        return self._save(doc, filename)
+
+    def build_05_predstavlen(self, doc):
+        page_count = self.tvim_doc.page_count or typeset_page_count(
+            self.tvim_doc._path(self.tvim_doc.jobname))
 
         last_digit = self.tvim_doc.art_number % 10
         if last_digit == 1:
@@ -756,7 +3096,7 @@ class ReportGenerator:
                         number=self.tvim_doc.number,
                         nart=self.tvim_doc.art_number,
                         art_word=art_word,
-                        pagenum=self.tvim_doc.page_count,
+                        pagenum=page_count,
                         pages_word=pages_word)
 
         p = doc.paragraphs[8]
@@ -779,11 +3119,7 @@ class ReportGenerator:
         p.paragraph_format.line_spacing = 1.5
         p.paragraph_format.alignment = 3
 
-        doc.save(os.path.join(self.root_path, '05predstavlen.docx'))
-
-    def build_06zayavlenie(self):
-        doc = Document(os.path.join(self.root_path, '06zayavlenie.docx'))
-
+    def build_06zayavlenie(self, doc):
         p = doc.paragraphs[9]
         p.text = 'Наименование: '
         run = p.add_run('Таврический вестник информатики и математики, '
@@ -792,12 +3128,7 @@ class ReportGenerator:
         run.bold = True
         run.underline = True
 
-        doc.save(os.path.join(self.template_path, '06zayavlenie.docx'))
-
-    def build_expertiza(self):
-        doc = Document(os.path.join(self.template_path,
-                                    'Приложение1_Экспертиза публикации.docx'))
-
+    def build_expertiza(self, doc):
         for p_index in [14, 22]:
             p = doc.paragraphs[p_index]
             p.text = ''
@@ -807,13 +3138,7 @@ class ReportGenerator:
                 '{}, №{}'.format(self.tvim_doc.year, self.tvim_doc.number))
             run.bold = True
 
-        doc.save(os.path.join(self.root_path,
-                              'Приложение1_Экспертиза публикации.docx'))
-
-    def build_export_doc(self):
-        doc = Document(os.path.join(self.root_path,
-                                    'Экспортное заключение.docx'))
-
+    def build_export_doc(self, doc):
         p = doc.paragraphs[14]
         p.text = ''
         p.add_run('Внутривузовская комиссия экспортного контроля рассмотрев ')
@@ -846,21 +3171,149 @@ class ReportGenerator:
                         'Российской Федерации не требуется.')
         run.italic = True
 
-        doc.save(os.path.join(self.root_path, 'Экспортное заключение.docx'))
+    def build(self, workers=None):
+        """
+        Создать документы выпуска.
 
-    def build(self):
+        Parameters
+        ----------
+            workers: int
+                Количество одновременно создаваемых документов (по
+                умолчанию все сразу)
+        """
         print('Создание документов...')
-        if os.path.exists(self.root_path):
-            shutil.rmtree(self.root_path)
-        shutil.copytree(self.template_path, self.root_path)
-        self.build_05_predstavlen()
-        self.build_06zayavlenie()
-        self.build_expertiza()
-        self.build_export_doc()
-        print('Создание документов успешно завершено')
+        os.makedirs(self.root_path, exist_ok=True)
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(
+                workers or len(self.documents)) as executor:
+            paths = list(executor.map(lambda d: self.build_document(*d),
+                                      self.documents))
+        print('Создание документов успешно завершено: {}'.format(
+            len(paths)))
+
+
+def _build_issue(task):
+    """
+    Собрать один выпуск пакетной сборки. Вывод сборки записывается в файл
+    `<jobname>.build.log` рабочего каталога выпуска.
+
+    Parameters
+    ----------
+        task: tuple
+            Путь к конфигурационному файлу, признак создания документов
+            (--report) и параметры конструктора TvimDocument
+    """
+    config_path, report, kwargs = task
+    wall = time.perf_counter()
+    result = {'config': config_path, 'issue': None, 'ok': False,
+              'pages': None, 'log': None, 'error': None}
+    try:
+        doc = TvimDocument.from_config(config_path, **kwargs)
+        result['issue'] = '{} №{}'.format(doc.year, doc.number)
+        os.makedirs(doc.workspace, exist_ok=True)
+        result['log'] = doc._path(doc.jobname + '.build.log')
+        with open(result['log'], 'wt') as log, \
+                contextlib.redirect_stdout(log), \
+                contextlib.redirect_stderr(log):
+            result['ok'] = doc.compile()
+            if result['ok'] and report:
+                ReportGenerator.from_config(doc, config_path).build()
+        result['pages'] = doc.page_count
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['wall'] = time.perf_counter() - wall
+    return result
+
+
+def build_issues(patterns, workers=None, report=False, **kwargs):
+    """
+    Пакетная сборка нескольких выпусков, например, для обновления архива
+    после изменения tvim.sty.
+
+    Выпуски собираются параллельно в пуле не более чем из workers процессов,
+    каждый в своем рабочем каталоге numbers/tvim_<год>_<номер>.
+
+    Parameters
+    ----------
+        patterns: list
+            Пути к конфигурационным файлам или шаблоны glob
+        workers: int
+            Количество одновременно собираемых выпусков (по умолчанию по
+            числу процессоров)
+        report: bool
+            Создать документы выпусков (ReportGenerator)
+        kwargs:
+            Параметры конструктора TvimDocument
+
+    Returns
+    -------
+        list
+            Результаты сборки выпусков в порядке конфигурационных файлов
+    """
+    config_paths = []
+    for pattern in patterns:
+        config_paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    results = [None] * len(config_paths)
+    tasks = []
+    workspaces = {}
+    for i, config_path in enumerate(config_paths):
+        # два конфигурационных файла одного выпуска не должны собираться
+        # в одном рабочем каталоге одновременно
+        try:
+            doc = TvimDocument.from_config(config_path, **kwargs)
+        except Exception as e:
+            results[i] = {'config': config_path, 'issue': None, 'ok': False,
+                          'pages': None, 'log': None, 'wall': 0,
+                          'error': '{}: {}'.format(type(e).__name__, e)}
+            continue
+        if doc.workspace in workspaces:
+            results[i] = {'config': config_path,
+                          'issue': '{} №{}'.format(doc.year, doc.number),
+                          'ok': False, 'pages': None, 'log': None, 'wall': 0,
+                          'error': 'выпуск уже собирается по {}'.format(
+                              workspaces[doc.workspace])}
+            continue
+        workspaces[doc.workspace] = config_path
+        tasks.append((i, (config_path, report, kwargs)))
+
+    if tasks:
+        import concurrent.futures
+        workers = min(workers or os.cpu_count() or 1, len(tasks))
+        print('Сборка выпусков: {}, процессов: {}'.format(len(tasks),
+                                                          workers))
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(_build_issue, task): i
+                       for i, task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                print('  {} {}: {} ({:.1f} с)'.format(
+                    result['config'], result['issue'] or '',
+                    'собран' if result['ok'] else 'ОШИБКА', result['wall']))
+    return results
+
+
+def print_batch_summary(results):
+    print('{:<40} {:<12} {:<8} {:>8} {:>10}'.format(
+        'Конфигурация', 'Выпуск', 'Итог', 'Страниц', 'Время, с'))
+    for r in results:
+        print('{:<40} {:<12} {:<8} {:>8} {:>10.1f}'.format(
+            r['config'], r['issue'] or '-', 'OK' if r['ok'] else 'ОШИБКА',
+            r['pages'] if r['pages'] is not None else '-', r['wall']))
+    failed = [r for r in results if not r['ok']]
+    for r in failed:
+        print('ОШИБКА {}: {}'.format(
+            r['config'], r['error'] or 'посмотрите, пожалуйста, {}'.format(
+                r['log'])))
+    print('Собрано выпусков: {} из {}'.format(
+        len(results) - len(failed), len(results)))
 
 
 if __name__ == '__main__':
+    import argparse
+
     argparser = argparse.ArgumentParser(description='TVIM compiler')
 
     argparser.add_argument('--config', '-C', type=str,
@@ -868,11 +3321,94 @@ if __name__ == '__main__':
                            help='path to config file in YAML format')
     argparser.add_argument('--report', '-R', action='store_true',
                            help='build report')
+    argparser.add_argument('--jobs', '-j', type=int, default=1,
+                           help='number of processes used to compile articles')
+    argparser.add_argument('--no-cache', action='store_true',
+                           help='recompile all articles ignoring build cache')
+    argparser.add_argument('--max-passes', type=int, default=4,
+                           help='maximum number of pdflatex passes')
+    argparser.add_argument('--no-format', action='store_true',
+                           help='do not use the cached preamble format file')
+    argparser.add_argument('--no-figures', action='store_true',
+                           help='do not convert EPS figures and downsample '
+                                'large raster figures')
+    argparser.add_argument('--offprints', action='store_true',
+                           help='write a PDF offprint of every article to '
+                                'the offprints directory of the issue')
+    argparser.add_argument('--split', action='store_true',
+                           help='typeset every article as a separate '
+                                'pdflatex job and merge the PDF files')
+    argparser.add_argument('--watch', action='store_true',
+                           help='keep running and rebuild the issue when '
+                                'articles or resources change')
+    argparser.add_argument('--debounce', type=float, default=0.5,
+                           help='seconds without changes before a rebuild '
+                                'in --watch mode')
+    argparser.add_argument('--profile', action='store_true',
+                           help='write build timing report and cProfile '
+                                'statistics next to the issue JSON')
+    argparser.add_argument('--check', action='store_true',
+                           help='only validate the articles (no staging, '
+                                'no pdflatex) and print a report')
+    argparser.add_argument('--check-report', type=str, default=None,
+                           metavar='PATH',
+                           help='also write the --check report as JSON')
+    argparser.add_argument('--export', type=str, action='append',
+                           choices=('crossref', 'elibrary'), default=[],
+                           help='write Crossref or eLibrary XML metadata '
+                                'next to the issue JSON (may be repeated); '
+                                'crossref requires --doi, --url and --email')
+    import tvim_export
+    tvim_export.add_crossref_arguments(argparser)
+    argparser.add_argument('--batch', type=str, nargs='+', metavar='CONFIG',
+                           help='build several issues concurrently; config '
+                                'paths or glob patterns (quote them)')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='number of issues built at once in --batch '
+                                'mode (default: number of CPUs)')
     args = argparser.parse_args()
-
-    tvim = TvimDocument.from_config(args.config)
-    tvim.compile()
+    export_options = tvim_export.crossref_options(argparser, args) \
+        if 'crossref' in args.export else {}
+
+    if args.batch:
+        if args.watch or args.profile or args.check or args.export:
+            argparser.error('--batch cannot be combined with --watch, '
+                            '--profile, --check or --export; export the '
+                            'issue JSON files with tvim_export.py')
+        batch_results = build_issues(args.batch, workers=args.workers,
+                                     report=args.report, jobs=args.jobs,
+                                     use_cache=not args.no_cache,
+                                     max_passes=args.max_passes,
+                                     split=args.split,
+                                     use_format=not args.no_format,
+                                     use_figures=not args.no_figures,
+                                     offprints=args.offprints)
+        print_batch_summary(batch_results)
+        sys.exit(0 if all(r['ok'] for r in batch_results) else 1)
+
+    tvim = TvimDocument.from_config(args.config, jobs=args.jobs,
+                                    use_cache=not args.no_cache,
+                                    max_passes=args.max_passes,
+                                    split=args.split,
+                                    use_format=not args.no_format,
+                                    use_figures=not args.no_figures,
+                                    offprints=args.offprints,
+                                    need_pages=bool(args.export),
+                                    profile=args.profile)
+    if args.check:
+        sys.exit(0 if tvim.check(args.check_report) else 1)
+    if args.watch:
+        tvim.watch(debounce=args.debounce)
+    elif tvim.compile() and args.export:
+        tvim_export.export_document(tvim, args.export, **export_options)
 
     if args.report:
         rep_gen = ReportGenerator.from_config(tvim, args.config)
-        rep_gen.build()
+        with tvim.profiler.phase('report'):
+            rep_gen.build()
+
+    if args.profile:
+        tvim.profiler.dump(os.path.join(tvim.root_path,
+                                        tvim.jobname + '.profile.json'),
+                           year=tvim.year, number=tvim.number)
+        tvim.profiler.print_summary()
@@ -0,0 +1,530 @@
+"""Crossref and eLibrary XML export of TVIM issues.
+
+Метаданные статей выпуска (авторы, заголовки, аннотации, ключевые слова,
+УДК, страницы, список литературы) в форматах Crossref (депонирование DOI)
+и eLibrary / РИНЦ. XML записывается потоком, по элементу, без построения
+дерева в памяти.
+
+Источник данных - статьи собранного выпуска (tvim.py --export) или
+JSON файлы выпусков `tvim_<год>_<номер>.json`, которые создает
+компилятор; исходные тексты статей повторно не разбираются.
+
+    python tvim_export.py elibrary                    # numbers/*/tvim_*.json
+    python tvim_export.py elibrary numbers/tvim_2020_3/tvim_2020_3.json
+    python tvim_export.py crossref -O export \\
+        --doi 10.1234/tvim.{year}.{number}.{position}
+
+MSC2010 ни в одной из схем места не имеет и не выгружается.
+"""
+import argparse
+import contextlib
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import time
+from xml.sax.saxutils import XMLGenerator
+
+logger = logging.getLogger('tvim')
+
+JOURNAL = {
+    'title': {'ru': 'Таврический вестник информатики и математики',
+              'en': 'Taurida Journal of Computer Science Theory and '
+                    'Mathematics'},
+    'abbrev title': 'TVIM',
+    'issn': '1729-3901',
+    'publisher': 'Крымский федеральный университет им. В. И. Вернадского',
+}
+
+_latex_command_re = re.compile(r'\\[A-Za-z@]+\*?|\\.|~')
+_space_re = re.compile(r'\s+')
+_math_re = re.compile(r'(\$\$.*?\$\$|\$.*?\$)', re.DOTALL)
+_simple_math_re = re.compile(r'\$([A-Za-z0-9]+)\$')
+# аргументы команд \tvimRef... и повторяющиеся после них точки
+_bib_argument_re = re.compile(r'\}\s*\{')
+_bib_dots_re = re.compile(r'\.(?:\s*\.)+')
+# английский вариант описания в списке литературы (см. __bib_templates__)
+_bib_en_re = re.compile(r'\\tvimRef[A-Za-z]*En\b')
+_author_split_re = re.compile(r',|\band\b')
+# имя JSON файла выпуска, который записывает компилятор
+_issue_json_re = re.compile(r'^tvim_\d+_\d+\.json$')
+
+
+def plain_text(text):
+    """
+    Текст без команд LaTeX: команды и неразрывные пробелы заменяются
+    пробелами, скобки удаляются, тире TeX заменяются символами тире.
+    Формулы остаются в записи TeX, кроме формул из одной буквы или числа.
+    """
+    text = _simple_math_re.sub(r'\1', text or '')
+    parts = _math_re.split(text)
+    for i in range(0, len(parts), 2):
+        part = parts[i].replace('---', '\u2014').replace('--', '\u2013')
+        part = _latex_command_re.sub(' ', part)
+        parts[i] = part.replace('{', '').replace('}', '')
+    return _space_re.sub(' ', ''.join(parts)).strip()
+
+
+class XmlWriter:
+    """
+    Потоковая запись XML с отступами. Элементы записываются в файл сразу,
+    дерево документа в памяти не строится.
+    """
+
+    def __init__(self, stream, indent='  '):
+        self._gen = XMLGenerator(stream, 'utf-8', short_empty_elements=True)
+        self._indent = indent
+        self._depth = 0
+        # startDocument уже перевел строку
+        self._first = True
+        self._gen.startDocument()
+
+    def _newline(self):
+        if self._first:
+            self._first = False
+            return
+        self._gen.ignorableWhitespace('\n' + self._indent * self._depth)
+
+    @contextlib.contextmanager
+    def element(self, name, attrs=None):
+        self._newline()
+        self._gen.startElement(name, attrs or {})
+        self._depth += 1
+        yield self
+        self._depth -= 1
+        self._newline()
+        self._gen.endElement(name)
+
+    def text(self, name, value, attrs=None):
+        """
+        Элемент с текстом; пустые значения пропускаются.
+        """
+        if value is None or value == '':
+            return
+        self._newline()
+        self._gen.startElement(name, attrs or {})
+        self._gen.characters(str(value))
+        self._gen.endElement(name)
+
+    def close(self):
+        self._gen.ignorableWhitespace('\n')
+        self._gen.endDocument()
+
+
+def split_name(author):
+    """
+    Фамилия и инициалы из строки вида 'Иванов А. Б.'.
+    """
+    parts = plain_text(author).split(maxsplit=1)
+    if not parts:
+        return '', ''
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+def article_authors(article):
+    """
+    Авторы статьи: пары (фамилия, инициалы) на русском и английском языке.
+    Английские имена берутся из abstractX и сопоставляются по порядку,
+    только если их столько же, сколько русских.
+    """
+    ru = [split_name(a) for a in article['authors']]
+    en = [split_name(a)
+          for a in _author_split_re.split(article.get('authors_en') or '')
+          if plain_text(a)]
+    if len(en) != len(ru):
+        en = [None] * len(ru)
+    return list(zip(ru, en))
+
+
+def split_reference(text):
+    """
+    Описание из списка литературы: русский и английский варианты
+    (английский может отсутствовать) без команд LaTeX.
+    """
+    def convert(text):
+        text = plain_text(_bib_argument_re.sub('. ', text))
+        return _bib_dots_re.sub('.', text)
+
+    m = _bib_en_re.search(text)
+    if m is None:
+        return convert(text), None
+    return convert(text[:m.start()]), convert(text[m.start():])
+
+
+def references_of(article):
+    """
+    Список литературы статьи (см. split_reference) без пустых описаний.
+    """
+    references = (split_reference(text)
+                  for text in (article.get('bibliography') or {}).values())
+    return [(ru, en) for ru, en in references if ru]
+
+
+def keyword_list(keywords):
+    return [k for k in (plain_text(k).rstrip('.').strip()
+                        for k in (keywords or '').split(','))
+            if k]
+
+
+def pages_of(article):
+    pages = article.get('pages') or {}
+    return pages.get('first'), pages.get('last')
+
+
+class CrossrefExporter:
+    """
+    Пакет депонирования Crossref (схема 4.4.2) для одного выпуска.
+
+    Шаблоны doi и url подставляются через str.format с полями year,
+    number, position (номер статьи в выпуске с 1) и first_page. Без
+    шаблона doi элемент doi_data не записывается, и такой пакет Crossref
+    не примет.
+    """
+    format = 'crossref'
+    # параметры write_issue, которые принимает конструктор
+    options = ('doi', 'url', 'depositor', 'email')
+    schema = 'http://www.crossref.org/schema/4.4.2'
+
+    def __init__(self, doi=None, url=None, depositor=None, email=None):
+        self.doi = doi
+        self.url = url
+        self.depositor = depositor or JOURNAL['title']['en']
+        self.email = email
+        if not doi:
+            logger.warning('Не задан шаблон DOI (--doi), пакет Crossref '
+                           'не пройдет проверку')
+
+    def write(self, issue, stream):
+        timestamp = time.strftime('%Y%m%d%H%M%S')
+        xml = XmlWriter(stream)
+        with xml.element('doi_batch', {
+                'version': '4.4.2', 'xmlns': self.schema,
+                'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+                'xmlns:jats': 'http://www.ncbi.nlm.nih.gov/JATS1',
+                'xsi:schemaLocation': '{0} {0}/crossref4.4.2.xsd'.format(
+                    self.schema)}):
+            with xml.element('head'):
+                xml.text('doi_batch_id', 'tvim_{}_{}_{}'.format(
+                    issue['year'], issue['number'], timestamp))
+                xml.text('timestamp', timestamp)
+                with xml.element('depositor'):
+                    xml.text('depositor_name', self.depositor)
+                    xml.text('email_address', self.email)
+                xml.text('registrant', JOURNAL['publisher'])
+            with xml.element('body'), xml.element('journal'):
+                with xml.element('journal_metadata', {'language': 'ru'}):
+                    xml.text('full_title', JOURNAL['title']['ru'])
+                    xml.text('abbrev_title', JOURNAL['abbrev title'])
+                    xml.text('issn', JOURNAL['issn'],
+                             {'media_type': 'print'})
+                with xml.element('journal_issue'):
+                    with xml.element('publication_date',
+                                     {'media_type': 'print'}):
+                        xml.text('year', issue['year'])
+                    xml.text('issue', issue['number'])
+                for position, article in enumerate(issue['articles'], 1):
+                    self._article(xml, issue, position, article)
+        xml.close()
+
+    def _article(self, xml, issue, position, article):
+        first, last = pages_of(article)
+        fields = {'year': issue['year'], 'number': issue['number'],
+                  'position': position, 'first_page': first}
+        with xml.element('journal_article', {
+                'publication_type': 'full_text', 'language': 'ru'}):
+            with xml.element('titles'):
+                xml.text('title', plain_text(article['title'].get('ru')))
+            with xml.element('contributors'):
+                for i, (ru, en) in enumerate(article_authors(article)):
+                    with xml.element('person_name', {
+                            'sequence': 'first' if i == 0 else 'additional',
+                            'contributor_role': 'author'}):
+                        xml.text('given_name', ru[1])
+                        xml.text('surname', ru[0])
+            for lang in ('ru', 'en'):
+                abstract = plain_text(article['abstracts'].get(lang))
+                if abstract:
+                    with xml.element('jats:abstract', {'xml:lang': lang}):
+                        xml.text('jats:p', abstract)
+            with xml.element('publication_date', {'media_type': 'print'}):
+                xml.text('year', issue['year'])
+            if first is not None:
+                with xml.element('pages'):
+                    xml.text('first_page', first)
+                    xml.text('last_page', last)
+            if self.doi:
+                with xml.element('doi_data'):
+                    xml.text('doi', self.doi.format(**fields))
+                    xml.text('resource', self.url.format(**fields)
+                             if self.url else None)
+            references = [ru for ru, _ in references_of(article)]
+            if references:
+                with xml.element('citation_list'):
+                    for i, text in enumerate(references, 1):
+                        with xml.element('citation',
+                                         {'key': 'ref{}'.format(i)}):
+                            xml.text('unstructured_citation', text)
+
+
+class ElibraryExporter:
+    """
+    Выпуск в формате загрузки eLibrary / РИНЦ (journal3): русские и
+    английские заголовки, авторы, аннотации и ключевые слова, УДК,
+    страницы, список литературы и файлы оттисков (tvim.py --offprints).
+    """
+    format = 'elibrary'
+    options = ()
+
+    def write(self, issue, stream):
+        xml = XmlWriter(stream)
+        with xml.element('journal'):
+            xml.text('issn', JOURNAL['issn'])
+            with xml.element('journalInfo', {'lang': 'RUS'}):
+                xml.text('title', JOURNAL['title']['ru'])
+            with xml.element('journalInfo', {'lang': 'ENG'}):
+                xml.text('title', JOURNAL['title']['en'])
+            with xml.element('issue'):
+                xml.text('number', issue['number'])
+                xml.text('altNumber', issue.get('total number'))
+                xml.text('dateUni', issue['year'])
+                if issue.get('pages'):
+                    xml.text('pages', '1-{}'.format(issue['pages']))
+                with xml.element('articles'):
+                    for article in issue['articles']:
+                        self._article(xml, article)
+        xml.close()
+
+    @staticmethod
+    def _article(xml, article):
+        with xml.element('article'):
+            first, last = pages_of(article)
+            if first is not None:
+                xml.text('pages', '{}-{}'.format(first, last))
+            xml.text('artType', 'RAR')
+            with xml.element('authors'):
+                for i, (ru, en) in enumerate(article_authors(article), 1):
+                    with xml.element('author', {'num': '{:03}'.format(i)}):
+                        for lang, name in (('RUS', ru), ('ENG', en)):
+                            if name:
+                                with xml.element('individInfo',
+                                                 {'lang': lang}):
+                                    xml.text('surname', name[0])
+                                    xml.text('initials', name[1])
+            with xml.element('artTitles'):
+                xml.text('artTitle', plain_text(article['title'].get('ru')),
+                         {'lang': 'RUS'})
+                xml.text('artTitle', plain_text(article.get('title_en')),
+                         {'lang': 'ENG'})
+            with xml.element('abstracts'):
+                for lang, key in (('RUS', 'ru'), ('ENG', 'en')):
+                    xml.text('abstract',
+                             plain_text(article['abstracts'].get(key)),
+                             {'lang': lang})
+            with xml.element('codes'):
+                xml.text('udk', article.get('УДК')
+                         if article.get('УДК') != '???' else None)
+            with xml.element('keywords'):
+                for lang, key in (('RUS', 'ru'), ('ENG', 'en')):
+                    with xml.element('kwdGroup', {'lang': lang}):
+                        for keyword in keyword_list(
+                                article['keywords'].get(key)):
+                            xml.text('keyword', keyword)
+            with xml.element('references'):
+                for ru, en in references_of(article):
+                    with xml.element('reference'):
+                        xml.text('refInfo', ru,
+                                 {'lang': 'RUS' if en else 'ANY'})
+                        xml.text('refInfo', en, {'lang': 'ENG'})
+            offprint = (article.get('pages') or {}).get('offprint')
+            if offprint:
+                with xml.element('files'):
+                    xml.text('file', os.path.basename(offprint),
+                             {'desc': 'fullText'})
+
+
+EXPORTERS = {cls.format: cls for cls in (CrossrefExporter, ElibraryExporter)}
+
+
+def issue_json_paths(patterns):
+    """
+    JSON файлы выпусков по путям и шаблонам glob. Из найденных по шаблону
+    файлов берутся только `tvim_<год>_<номер>.json`, остальные JSON файлы
+    каталога выпуска (отчет --profile и т.п.) пропускаются. Явно указанный
+    путь и шаблон без совпадений возвращаются как есть: ошибка будет видна
+    при чтении (см. load_issue).
+    """
+    paths = []
+    for pattern in patterns:
+        found = sorted(glob.glob(pattern))
+        if not found or found == [pattern]:
+            paths.append(pattern)
+        else:
+            paths.extend(path for path in found
+                         if _issue_json_re.match(os.path.basename(path)))
+    return paths
+
+
+def issue_problem(issue):
+    """
+    Почему JSON документ не является описанием выпуска
+    (TvimDocument.as_dict) или None, если является.
+    """
+    if not isinstance(issue, dict):
+        return 'не словарь'
+    for key in ('year', 'number'):
+        if not isinstance(issue.get(key), int):
+            return 'нет поля {}'.format(key)
+    if not isinstance(issue.get('articles'), list):
+        return 'нет списка статей'
+    for i, article in enumerate(issue['articles'], 1):
+        if not isinstance(article, dict) \
+                or not all(key in article for key in ('title', 'authors')):
+            return 'у статьи {} нет заголовка или авторов'.format(i)
+    return None
+
+
+def load_issue(path):
+    """
+    Прочитать JSON файл выпуска. Если файл не разбирается или не похож на
+    выпуск, выводится предупреждение и возвращается None.
+    """
+    try:
+        with open(path, 'rt') as f:
+            issue = json.load(f)
+    except ValueError as e:
+        logger.warning('{}: не JSON файл ({}), пропущен'.format(path, e))
+        return None
+    problem = issue_problem(issue)
+    if problem:
+        logger.warning('{}: не JSON файл выпуска ({}), пропущен'.format(
+            path, problem))
+        return None
+    return issue
+
+
+def add_crossref_arguments(parser):
+    """
+    Параметры пакета Crossref в командной строке (tvim_export.py и
+    tvim.py --export crossref).
+    """
+    parser.add_argument('--doi', type=str, default=None,
+                        help='Crossref DOI pattern with {year}, {number}, '
+                             '{position} and {first_page} fields')
+    parser.add_argument('--url', type=str, default=None,
+                        help='Crossref resource URL pattern, same fields')
+    parser.add_argument('--depositor', type=str, default=None,
+                        help='Crossref depositor name')
+    parser.add_argument('--email', type=str, default=None,
+                        help='Crossref depositor e-mail')
+
+
+def crossref_options(parser, args):
+    """
+    Параметры CrossrefExporter из командной строки; без DOI, адреса
+    статьи и e-mail Crossref пакет не примет, поэтому они обязательны.
+    """
+    missing = [name for name in ('doi', 'url', 'email')
+               if not getattr(args, name)]
+    if missing:
+        parser.error('Crossref export requires {}'.format(
+            ', '.join('--' + name for name in missing)))
+    return {name: getattr(args, name) for name in CrossrefExporter.options}
+
+
+def write_issue(fmt, issue, path, **options):
+    """
+    Записать выпуск в формате fmt в файл path. Файл заменяется только
+    после успешной записи. Из options экспортеру передаются только его
+    параметры.
+    """
+    cls = EXPORTERS[fmt]
+    exporter = cls(**{name: value for name, value in options.items()
+                      if name in cls.options})
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            exporter.write(issue, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
+
+
+def document_issue(doc):
+    """
+    Выпуск в формате TvimDocument.as_dict; описания статей создаются по
+    одному при записи.
+    """
+    issue = doc.as_dict(articles=False)
+    issue['articles'] = (doc.article_dict(a) for a in doc.articles)
+    return issue
+
+
+def export_document(doc, formats, **options):
+    """
+    Записать метаданные собранного выпуска doc в рабочий каталог выпуска
+    (`tvim_<год>_<номер>.<формат>.xml`).
+    """
+    for fmt in formats:
+        path = write_issue(fmt, document_issue(doc),
+                           doc._path('{}.{}.xml'.format(doc.jobname, fmt)),
+                           **options)
+        print('Метаданные {}: {}'.format(fmt, path))
+
+
+def export_file(task):
+    """
+    Выгрузить JSON файл выпуска. Вынесено на уровень модуля для пула
+    процессов.
+    """
+    fmt, json_path, output_dir, options = task
+    issue = load_issue(json_path)
+    if issue is None:
+        return None
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    return write_issue(fmt, issue, os.path.join(
+        output_dir or os.path.dirname(json_path),
+        '{}.{}.xml'.format(name, fmt)), **options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='TVIM Crossref / eLibrary metadata export')
+    parser.add_argument('format', choices=sorted(EXPORTERS))
+    parser.add_argument('exports', type=str, nargs='*',
+                        help='issue JSON files or glob patterns '
+                             '(default: numbers/*/tvim_*.json)')
+    parser.add_argument('--output', '-O', type=str, default=None,
+                        help='output directory (default: next to the JSON '
+                             'file)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of issues exported at once')
+    add_crossref_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    options = {}
+    if args.format == 'crossref':
+        options = crossref_options(parser, args)
+    paths = issue_json_paths(args.exports or [
+        os.path.join('numbers', '*', 'tvim_*.json')])
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    tasks = [(args.format, path, args.output, options) for path in paths]
+    if args.jobs > 1 and len(tasks) > 1:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(
+                min(args.jobs, len(tasks))) as executor:
+            results = list(executor.map(export_file, tasks))
+    else:
+        results = [export_file(task) for task in tasks]
+    written = [path for path in results if path]
+    for path in written:
+        print(path)
+    if not written:
+        print('ОШИБКА: не найдено ни одного JSON файла выпуска')
+        sys.exit(1)
@@ -0,0 +1,420 @@
+"""Cross-issue metadata index of the TVIM journal.
+
+Индекс статей всех выпусков в базе SQLite. Источник данных - JSON файлы
+выпусков `tvim_<год>_<номер>.json`, которые создает компилятор, или
+каталоги статей выпуска (метаданные извлекаются из исходных текстов без
+компиляции).
+
+Авторы, УДК и MSC2010 хранятся в индексированных таблицах, заголовки,
+аннотации, ключевые слова и список литературы - в полнотекстовом индексе
+FTS5. Выпуск индексируется заново, только если изменился его источник.
+
+Индексация:
+    python tvim_index.py ingest                       # numbers/*/tvim_*.json
+    python tvim_index.py ingest numbers/tvim_2020_3/tvim_2020_3.json
+    python tvim_index.py ingest --config configs/config_2020_1.yaml
+
+Поиск:
+    python tvim_index.py search --author Иванов
+    python tvim_index.py search --msc 35P
+    python tvim_index.py search "цепные дроби" --year 2020
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+logger = logging.getLogger('tvim')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    id INTEGER PRIMARY KEY,
+    year INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    UNIQUE (year, number)
+);
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    issue_id INTEGER NOT NULL REFERENCES issues (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT,
+    authors TEXT,
+    udc TEXT,
+    msc2010 TEXT
+);
+CREATE INDEX IF NOT EXISTS articles_issue ON articles (issue_id);
+CREATE TABLE IF NOT EXISTS authors (
+    article_id INTEGER NOT NULL REFERENCES articles (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    family TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS authors_family ON authors (family);
+CREATE INDEX IF NOT EXISTS authors_article ON authors (article_id);
+CREATE TABLE IF NOT EXISTS codes (
+    article_id INTEGER NOT NULL REFERENCES articles (id) ON DELETE CASCADE,
+    scheme TEXT NOT NULL,
+    code TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS codes_code ON codes (scheme, code);
+CREATE INDEX IF NOT EXISTS codes_article ON codes (article_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5 (
+    title, abstracts, keywords, bibliography, tokenize = 'unicode61'
+);
+"""
+
+_latex_command_re = re.compile(r'\\[A-Za-z@]+\*?|\\.|[{}$~]')
+_space_re = re.compile(r'\s+')
+_code_split_re = re.compile(r'[,;]|\s{2,}')
+
+
+def plain_text(text):
+    """
+    Текст без команд LaTeX для полнотекстового индекса.
+    """
+    return _space_re.sub(' ', _latex_command_re.sub(' ', text or '')).strip()
+
+
+def split_codes(value):
+    """
+    Коды классификации из строки вида '35P15, 47A10'. Значение '???'
+    (код не найден при компиляции) пропускается.
+    """
+    codes = [c.strip().rstrip('.') for c in _code_split_re.split(value or '')]
+    return [c for c in codes if c and c != '???']
+
+
+def _family(author):
+    return author.split()[0].lower() if author.strip() else ''
+
+
+class MetadataIndex:
+    """
+    База SQLite с метаданными статей выпусков.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_current(self, year, number, digest):
+        row = self.connection.execute(
+            'SELECT digest FROM issues WHERE year = ? AND number = ?',
+            (year, number)).fetchone()
+        return row is not None and row[0] == digest
+
+    def current_source(self, source, digest):
+        """
+        Год и номер выпуска, проиндексированного из source с хэшем digest,
+        или None, если источник изменился или еще не индексировался.
+        """
+        return self.connection.execute(
+            'SELECT year, number FROM issues WHERE source = ? AND digest = ?',
+            (source, digest)).fetchone()
+
+    def ingest(self, issue, source, digest):
+        """
+        Заменить в индексе статьи выпуска.
+
+        Parameters
+        ----------
+            issue: dict
+                Выпуск в формате TvimDocument.as_dict
+            source: str
+                Путь к источнику данных
+            digest: str
+                Хэш источника; если он не изменился, выпуск не
+                индексируется повторно
+
+        Returns
+        -------
+            bool
+                True, если выпуск проиндексирован заново
+        """
+        year, number = issue['year'], issue['number']
+        if self.is_current(year, number, digest):
+            return False
+        with self.connection as db:
+            old = db.execute('SELECT id FROM issues WHERE year = ? AND '
+                             'number = ?', (year, number)).fetchone()
+            if old:
+                db.execute('DELETE FROM articles_fts WHERE rowid IN '
+                           '(SELECT id FROM articles WHERE issue_id = ?)',
+                           old)
+                db.execute('DELETE FROM issues WHERE id = ?', old)
+            issue_id = db.execute(
+                'INSERT INTO issues (year, number, source, digest) '
+                'VALUES (?, ?, ?, ?)',
+                (year, number, source, digest)).lastrowid
+            for position, article in enumerate(issue['articles']):
+                self._insert_article(db, issue_id, position, article)
+        return True
+
+    @staticmethod
+    def _insert_article(db, issue_id, position, article):
+        authors = article.get('authors', [])
+        udc = article.get('УДК')
+        msc2010 = article.get('MSC2010')
+        article_id = db.execute(
+            'INSERT INTO articles (issue_id, position, title, authors, udc, '
+            'msc2010) VALUES (?, ?, ?, ?, ?, ?)',
+            (issue_id, position, article.get('title', {}).get('ru'),
+             ', '.join(authors), udc, msc2010)).lastrowid
+        db.executemany(
+            'INSERT INTO authors (article_id, name, family) VALUES (?, ?, ?)',
+            [(article_id, author, _family(author)) for author in authors])
+        db.executemany(
+            'INSERT INTO codes (article_id, scheme, code) VALUES (?, ?, ?)',
+            [(article_id, 'udc', code) for code in split_codes(udc)]
+            + [(article_id, 'msc2010', code.upper())
+               for code in split_codes(msc2010)])
+        db.execute(
+            'INSERT INTO articles_fts (rowid, title, abstracts, keywords, '
+            'bibliography) VALUES (?, ?, ?, ?, ?)',
+            (article_id, plain_text(article.get('title', {}).get('ru')),
+             plain_text(' '.join(article.get('abstracts', {}).values())),
+             plain_text(' '.join(article.get('keywords', {}).values())),
+             plain_text(' '.join(article.get('bibliography', {}).values()))))
+
+    def search(self, text=None, author=None, udc=None, msc=None, year=None,
+               number=None, limit=50):
+        """
+        Найти статьи. Все заданные условия должны выполняться одновременно.
+
+        Parameters
+        ----------
+            text: str
+                Запрос FTS5 по заголовкам, аннотациям, ключевым словам и
+                списку литературы
+            author: str
+                Фамилия автора (без учета регистра)
+            udc, msc: str
+                Начало кода УДК или MSC2010, например, '517.9' или '35P'
+            year, number: int
+                Год и номер выпуска
+
+        Returns
+        -------
+            list
+                Найденные статьи (словари)
+        """
+        columns = ['a.id', 'i.year', 'i.number', 'a.title', 'a.authors',
+                   'a.udc', 'a.msc2010']
+        tables = ['articles a JOIN issues i ON i.id = a.issue_id']
+        where, params = [], []
+        order = 'i.year, i.number, a.position'
+        if text:
+            columns.append("snippet(articles_fts, -1, '[', ']', '...', 12)")
+            tables.append('JOIN articles_fts f ON f.rowid = a.id')
+            where.append('articles_fts MATCH ?')
+            params.append(text)
+            order = 'f.rank'
+        if author:
+            where.append('a.id IN (SELECT article_id FROM authors '
+                         'WHERE family = ?)')
+            params.append(author.lower())
+        for scheme, code in (('udc', udc), ('msc2010', msc)):
+            if code:
+                if scheme == 'msc2010':
+                    code = code.upper()
+                # GLOB, в отличие от LIKE, использует индекс codes_code
+                where.append('a.id IN (SELECT article_id FROM codes '
+                             'WHERE scheme = ? AND code GLOB ?)')
+                params.extend([scheme, _glob_escape(code) + '*'])
+        if year:
+            where.append('i.year = ?')
+            params.append(year)
+        if number:
+            where.append('i.number = ?')
+            params.append(number)
+        query = 'SELECT {} FROM {}'.format(', '.join(columns),
+                                           ' '.join(tables))
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY {} LIMIT ?'.format(order)
+        params.append(limit)
+        keys = ['id', 'year', 'number', 'title', 'authors', 'УДК', 'MSC2010',
+                'snippet']
+        return [dict(zip(keys, row))
+                for row in self.connection.execute(query, params)]
+
+    def issues(self):
+        return self.connection.execute(
+            'SELECT i.year, i.number, count(a.id), i.source FROM issues i '
+            'LEFT JOIN articles a ON a.issue_id = i.id '
+            'GROUP BY i.id ORDER BY i.year, i.number').fetchall()
+
+
+def _glob_escape(text):
+    return re.sub(r'([*?\[])', r'[\1]', text)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ingest_exports(index, patterns):
+    """
+    Проиндексировать JSON файлы выпусков. Файл читается, только если его
+    содержимое изменилось с прошлой индексации. Файлы, которые не являются
+    описанием выпуска (см. tvim_export.load_issue), пропускаются, уже
+    проиндексированный выпуск при этом не удаляется.
+    """
+    import tvim_export
+
+    for path in tvim_export.issue_json_paths(patterns):
+        digest = file_digest(path)
+        current = index.current_source(os.path.abspath(path), digest)
+        if current:
+            print('{} {} №{}: без изменений'.format(path, *current))
+            continue
+        issue = tvim_export.load_issue(path)
+        if issue is None:
+            continue
+        updated = index.ingest(issue, os.path.abspath(path), digest)
+        print('{} {} №{}: {}'.format(
+            path, issue['year'], issue['number'],
+            'статей {}'.format(len(issue['articles'])) if updated
+            else 'без изменений'))
+
+
+def parse_issue(config_path):
+    """
+    Извлечь метаданные статей выпуска из исходных текстов (без компиляции).
+
+    Returns
+    -------
+        tuple
+            Выпуск в формате TvimDocument.as_dict и хэш исходных текстов
+    """
+    import yaml
+    import tvim
+
+    with open(config_path, 'rt') as config_file:
+        config = yaml.load(config_file, Loader=yaml.SafeLoader)
+    articles_path = os.path.abspath(config['path']['articles'])
+    h = hashlib.sha256(tvim.__version__.encode())
+    articles = []
+    for name in sorted(os.listdir(articles_path)):
+        if name.startswith(('.', '-')) \
+                or not os.path.isdir(os.path.join(articles_path, name)):
+            continue
+        article_cls, root, path, *args = tvim.article_task(articles_path,
+                                                           name)
+        if article_cls is not tvim.Article:
+            continue
+        article = article_cls(path, *args, root=root)
+        h.update(name.encode())
+        h.update((article.text or '').encode())
+        # extract_sections печатает найденные разделы
+        with contextlib.redirect_stdout(io.StringIO()):
+            article.parse()
+        articles.append(article)
+    articles.sort(key=lambda a: a.authors_str)
+    issue = {'year': config['tvim']['year'],
+             'number': config['tvim']['number'],
+             'articles': [a.as_dict() for a in articles]}
+    return issue, h.hexdigest()
+
+
+def print_results(results):
+    for r in results:
+        print('{} №{}  {}  {}'.format(r['year'], r['number'], r['authors'],
+                                      plain_text(r['title'])))
+        print('    УДК {}, MSC2010 {}'.format(r['УДК'], r['MSC2010']))
+        if r.get('snippet'):
+            print('    ' + _space_re.sub(' ', r['snippet']))
+    print('Найдено статей: {}'.format(len(results)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TVIM metadata index')
+    parser.add_argument('--db', type=str,
+                        default=os.path.join('numbers', 'tvim_index.sqlite'),
+                        help='SQLite database path')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser(
+        'ingest', help='index issue JSON exports or article sources')
+    ingest_parser.add_argument('exports', type=str, nargs='*',
+                               help='issue JSON files or glob patterns '
+                                    '(default: numbers/*/tvim_*.json)')
+    ingest_parser.add_argument('--config', '-C', type=str, action='append',
+                               default=[],
+                               help='parse articles of the issue directly '
+                                    '(may be repeated)')
+
+    search_parser = subparsers.add_parser('search', help='find articles')
+    search_parser.add_argument('text', type=str, nargs='?', default=None,
+                               help='FTS5 query over titles, abstracts, '
+                                    'keywords and bibliography')
+    search_parser.add_argument('--author', type=str, default=None,
+                               help='author family name')
+    search_parser.add_argument('--udc', type=str, default=None,
+                               help='UDC code prefix')
+    search_parser.add_argument('--msc', type=str, default=None,
+                               help='MSC2010 code prefix')
+    search_parser.add_argument('--year', type=int, default=None)
+    search_parser.add_argument('--number', type=int, default=None)
+    search_parser.add_argument('--limit', type=int, default=50)
+    search_parser.add_argument('--json', action='store_true',
+                               help='print results as JSON')
+
+    subparsers.add_parser('issues', help='list indexed issues')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+
+    with MetadataIndex(args.db) as index:
+        if args.command == 'ingest':
+            for config_path in args.config:
+                issue, digest = parse_issue(config_path)
+                updated = index.ingest(issue, os.path.abspath(config_path),
+                                       digest)
+                print('{} {} №{}: {}'.format(
+                    config_path, issue['year'], issue['number'],
+                    'статей {}'.format(len(issue['articles'])) if updated
+                    else 'без изменений'))
+            if args.exports or not args.config:
+                ingest_exports(index, args.exports or [
+                    os.path.join('numbers', '*', 'tvim_*.json')])
+        elif args.command == 'search':
+            try:
+                results = index.search(args.text, author=args.author,
+                                       udc=args.udc, msc=args.msc,
+                                       year=args.year, number=args.number,
+                                       limit=args.limit)
+            except sqlite3.OperationalError as e:
+                print('ОШИБКА в запросе: {}'.format(e))
+                sys.exit(1)
+            if args.json:
+                print(json.dumps(results, ensure_ascii=False, indent=4))
+            else:
+                print_results(results)
+        else:
+            for year, number, count, source in index.issues():
+                print('{} №{}: статей {} ({})'.format(year, number, count,
+                                                      source))
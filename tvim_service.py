@@ -0,0 +1,799 @@
+"""Local build service of the TVIM compiler.
+
+Сервис предварительной сборки статей. Автор или редактор отправляет каталог
+статьи (или zip/tar архив с ним) и получает журнал сборки и PDF файл статьи,
+сверстанной так же, как в выпуске, без доступа к командной строке сервера.
+
+Задания ставятся в очередь; одновременно выполняется не более --workers
+заданий (запусков pdflatex). Повторная отправка статьи с тем же содержимым
+не создает нового задания, а возвращает уже существующее.
+
+Запуск сервиса:
+    python tvim_service.py serve -C configs/config.yaml [--port 8765]
+    python tvim_service.py serve -C configs/config.yaml --unix /tmp/tvim.sock
+
+Завершенные задания и их рабочие каталоги удаляются через --job-ttl
+секунд или когда их становится больше --max-jobs.
+
+Отправка статьи:
+    python tvim_service.py submit articles/ivanov [-O ivanov.pdf]
+
+HTTP API:
+    POST /jobs              тело - zip/tar архив каталога статьи или JSON
+                            {"path": "<каталог статьи на сервере>"}; путь
+                            принимается, только если сервис запущен с
+                            --allow-path и каталог находится внутри него
+    GET  /jobs              список заданий
+    GET  /jobs/<id>         состояние задания
+    GET  /jobs/<id>/log     журнал сборки; строки передаются по мере
+                            появления, пока задание не завершится
+    GET  /jobs/<id>/pdf     PDF файл статьи
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import ipaddress
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+import tvim
+
+logger = logging.getLogger('tvim')
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request',
+                403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+                409: 'Conflict', 413: 'Payload Too Large',
+                500: 'Internal Server Error'}
+
+
+def tree_hash(path):
+    """
+    Хэш содержимого каталога: относительные имена и содержимое файлов.
+    Служебные файлы `__*` (результаты сборки) не учитываются.
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith('__'):
+                continue
+            file_path = os.path.join(root, name)
+            h.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def _safe_name(name):
+    name = name.replace('\\', '/')
+    return not name.startswith('/') and not re.match(r'[A-Za-z]:', name) \
+        and '..' not in name.split('/')
+
+
+def _check_unpacked_size(size, max_size):
+    if max_size is not None and size > max_size:
+        raise ValueError('Слишком большой каталог статьи в архиве')
+
+
+def extract_archive(payload, dst, max_size=None):
+    """
+    Распаковать zip или tar (в том числе сжатый) архив в каталог dst.
+    Файлы с абсолютными путями, путями вне dst и ссылки не допускаются.
+    Суммарный размер распакованных файлов по заголовкам архива проверяется
+    до распаковки и не должен превышать max_size.
+    """
+    data = io.BytesIO(payload)
+    if zipfile.is_zipfile(data):
+        with zipfile.ZipFile(data) as archive:
+            members = archive.infolist()
+            for member in members:
+                if not _safe_name(member.filename):
+                    raise ValueError('Недопустимый путь в архиве: '
+                                     + member.filename)
+            # zipfile не распаковывает больше file_size байт файла
+            _check_unpacked_size(sum(m.file_size for m in members), max_size)
+            archive.extractall(dst)
+        return
+    data.seek(0)
+    try:
+        archive = tarfile.open(fileobj=data)
+    except tarfile.TarError:
+        raise ValueError('Ожидается zip или tar архив каталога статьи')
+    with archive:
+        members = archive.getmembers()
+        for member in members:
+            if not _safe_name(member.name) \
+                    or not (member.isfile() or member.isdir()):
+                raise ValueError('Недопустимый файл в архиве: ' + member.name)
+        _check_unpacked_size(sum(m.size for m in members), max_size)
+        archive.extractall(dst, members)
+
+
+def is_loopback(host):
+    """
+    Адрес доступен только с этой машины.
+    """
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _article_dir(path):
+    """
+    Каталог статьи в распакованном архиве: единственный каталог верхнего
+    уровня или сам каталог распаковки.
+    """
+    entries = [e for e in os.scandir(path) if not e.name.startswith('.')]
+    if len(entries) == 1 and entries[0].is_dir():
+        return entries[0].path
+    return path
+
+
+class BuildJob:
+    """
+    Задание предварительной сборки статьи.
+
+    Журнал сборки хранится в памяти; читатели журнала (follow) получают
+    новые строки по мере их появления.
+    """
+    def __init__(self, job_id, name, upload_path):
+        self.id = job_id
+        self.name = name
+        self.upload_path = upload_path
+        self.status = 'queued'
+        self.error = None
+        self.pages = None
+        self.pdf_path = None
+        self.log = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._updated = asyncio.Event()
+
+    done = property(lambda self: self.status in ('done', 'failed'))
+
+    def append(self, line):
+        self.log.append(line)
+        self._notify()
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        if error:
+            self.log.append('ОШИБКА: ' + error)
+        self._notify()
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def follow(self):
+        """
+        Строки журнала от начала до завершения задания.
+        """
+        pos = 0
+        while True:
+            updated = self._updated
+            while pos < len(self.log):
+                yield self.log[pos]
+                pos += 1
+            if self.done:
+                return
+            await updated.wait()
+
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name, 'status': self.status,
+                'error': self.error, 'pages': self.pages,
+                'created': self.created, 'started': self.started,
+                'finished': self.finished, 'log_lines': len(self.log)}
+
+
+class _JobLogHandler(logging.Handler):
+    """
+    Передает сообщения логгера tvim, записанные в потоке компиляции
+    статьи, в журнал задания.
+    """
+    def __init__(self, job, loop):
+        super().__init__()
+        self.job = job
+        self.loop = loop
+        self.thread = threading.get_ident()
+
+    def filter(self, record):
+        return record.thread == self.thread
+
+    def emit(self, record):
+        self.loop.call_soon_threadsafe(self.job.append, self.format(record))
+
+
+class BuildService:
+    """
+    Очередь заданий предварительной сборки статей.
+
+    Каждое задание собирается в отдельном рабочем каталоге
+    `<workdir>/<id>`: туда размещаются ресурсы журнала и статья,
+    статья компилируется (Article.compile), после чего pdflatex верстает
+    ее отдельно, как в режиме --split.
+    """
+    # имена рабочих каталогов заданий (см. submit)
+    _job_id_re = re.compile(r'^[0-9a-f]{16}$')
+
+    def __init__(self, config, workdir, workers=2, max_passes=3,
+                 use_format=True, use_figures=True, allow_path=None,
+                 max_jobs=100, job_ttl=24 * 3600):
+        """
+        Parameters
+        ----------
+            allow_path: str
+                Каталог сервера, статьи из которого можно отправлять по
+                пути (JSON {"path": ...}); по умолчанию отправка по пути
+                запрещена
+            max_jobs: int
+                Количество хранимых завершенных заданий
+            job_ttl: float
+                Время хранения завершенного задания, с
+        """
+        self.config = config
+        self.workdir = os.path.abspath(workdir)
+        self.workers = workers
+        self.max_passes = max_passes
+        self.use_figures = use_figures
+        self.allow_path = os.path.realpath(allow_path) if allow_path \
+            else None
+        self.max_jobs = max_jobs
+        self.job_ttl = job_ttl
+        self.format_cache = None
+        if use_format:
+            format_path = config['path'].get(
+                'formats', os.path.join('numbers', '.cache', 'formats'))
+            self.format_cache = tvim.FormatCache(os.path.abspath(format_path))
+        self.jobs = {}
+        self.queue = None
+        self._tasks = []
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        # каталоги заданий прошлого запуска сервиса больше не нужны
+        uploads = os.path.join(self.workdir, 'uploads')
+        shutil.rmtree(uploads, ignore_errors=True)
+        if os.path.isdir(self.workdir):
+            for entry in os.scandir(self.workdir):
+                if entry.is_dir(follow_symlinks=False) \
+                        and self._job_id_re.match(entry.name):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        os.makedirs(uploads, exist_ok=True)
+        self._tasks = [asyncio.ensure_future(self._worker())
+                       for _ in range(self.workers)]
+
+    def _check_path(self, path):
+        """
+        Проверить каталог статьи, отправленный по пути: он должен
+        находиться внутри allow_path, ссылки в нем не должны вести наружу,
+        а объем не должен превышать max_upload.
+        """
+        if self.allow_path is None:
+            raise PermissionError('Отправка статьи по пути запрещена '
+                                  '(сервис запущен без --allow-path)')
+        real_path = os.path.realpath(path)
+
+        def inside(p):
+            return os.path.commonpath([p, self.allow_path]) == \
+                self.allow_path
+
+        if not inside(real_path) or real_path == self.allow_path:
+            raise PermissionError('Каталог {} вне разрешенного '
+                                  'каталога'.format(path))
+        if not os.path.isdir(real_path):
+            raise ValueError('Нет каталога статьи ' + path)
+        # каталог копируется со ссылками на файлы внутри allow_path
+        size = 0
+        seen = set()
+        for root, dirs, files in os.walk(real_path, followlinks=True):
+            if os.path.realpath(root) in seen:
+                dirs[:] = []
+                continue
+            seen.add(os.path.realpath(root))
+            for name in dirs + files:
+                file_path = os.path.join(root, name)
+                if os.path.islink(file_path) \
+                        and not inside(os.path.realpath(file_path)):
+                    raise PermissionError('Ссылка {} ведет за пределы '
+                                          'разрешенного каталога'.format(
+                                              file_path))
+            for name in files:
+                size += os.path.getsize(os.path.join(root, name))
+            if size > self.max_upload:
+                raise ValueError('Слишком большой каталог статьи')
+        return real_path
+
+    def _stage_upload(self, payload=None, path=None):
+        """
+        Скопировать присланную статью во временный каталог и вычислить хэш
+        ее содержимого.
+        """
+        upload = tempfile.mkdtemp(dir=os.path.join(self.workdir, 'uploads'))
+        try:
+            if path is not None:
+                path = self._check_path(path)
+                name = os.path.basename(path)
+                shutil.copytree(path, os.path.join(upload, name))
+            else:
+                extract_archive(payload, upload, self.max_upload)
+            article_dir = _article_dir(upload)
+            if article_dir == upload:
+                name = 'article'
+                os.rename(upload, upload + '.tmp')
+                os.makedirs(upload)
+                os.rename(upload + '.tmp', os.path.join(upload, name))
+                article_dir = os.path.join(upload, name)
+            return article_dir, tree_hash(article_dir)
+        except BaseException:
+            shutil.rmtree(upload, ignore_errors=True)
+            raise
+
+    async def submit(self, payload=None, path=None):
+        """
+        Поставить статью в очередь.
+
+        Returns
+        -------
+            tuple
+                Задание и признак того, что оно создано (False - статья с
+                таким содержимым уже была отправлена)
+        """
+        self.prune()
+        article_dir, digest = await asyncio.to_thread(
+            self._stage_upload, payload, path)
+        job_id = digest[:16]
+        job = self.jobs.get(job_id)
+        # неудачную сборку можно повторить, например, после исправления
+        # ресурсов журнала
+        if job and job.status != 'failed':
+            shutil.rmtree(os.path.dirname(article_dir), ignore_errors=True)
+            return job, False
+        job = BuildJob(job_id, os.path.basename(article_dir), article_dir)
+        self.jobs[job_id] = job
+        self.queue.put_nowait(job)
+        job.append('Задание {} поставлено в очередь ({} в очереди)'.format(
+            job_id, self.queue.qsize()))
+        return job, True
+
+    def prune(self, now=None):
+        """
+        Удалить завершенные задания старше job_ttl и самые старые из
+        завершенных сверх max_jobs вместе с их рабочими каталогами.
+        """
+        now = now or time.time()
+        finished = sorted((job for job in self.jobs.values() if job.done),
+                          key=lambda job: job.finished)
+        extra = len(finished) - self.max_jobs
+        for i, job in enumerate(finished):
+            if i < extra or now - job.finished > self.job_ttl:
+                del self.jobs[job.id]
+                shutil.rmtree(os.path.join(self.workdir, job.id),
+                              ignore_errors=True)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._build(job)
+            except Exception as e:
+                logger.exception('Задание {}'.format(job.id))
+                job.finish('failed', '{}: {}'.format(type(e).__name__, e))
+            finally:
+                self.queue.task_done()
+                self.prune()
+
+    def _prepare(self, job, workspace):
+        """
+        Подготовить рабочий каталог задания и скомпилировать статью.
+        Выполняется в отдельном потоке.
+        """
+        if os.path.exists(workspace):
+            shutil.rmtree(workspace)
+        doc = tvim.TvimDocument(self.config, use_cache=False,
+                                use_format=False, use_figures=self.use_figures,
+                                max_passes=self.max_passes)
+        doc.root_path = workspace
+        tvim.sync_tree(doc.resources, workspace,
+                       materialize=doc.rewritten_files)
+        os.makedirs(doc._path('articles'), exist_ok=True)
+        art_path = os.path.join('articles', job.name)
+        shutil.move(job.upload_path, doc._path(art_path))
+        shutil.rmtree(os.path.dirname(job.upload_path), ignore_errors=True)
+        job.upload_path = None
+        os.replace(doc._path('tvim_main.tex'),
+                   doc._path(doc.jobname + '.tex'))
+        doc._update_params()
+
+        if doc.figure_cache:
+            doc.figure_cache.prepare(doc._path(art_path))
+        article_cls, root, path, *args = tvim.article_task(workspace,
+                                                           art_path)
+        article = article_cls(path, *args, root=root)
+        article.compile()
+        if isinstance(article, tvim.VerbatimArticle):
+            doc.verbatim_articles = [article]
+        else:
+            doc.articles = [article]
+        if self.format_cache:
+            doc.fmt = self.format_cache.prepare(doc.jobname + '.tex',
+                                                cwd=workspace)
+        return doc, article
+
+    async def _build(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        workspace = os.path.join(self.workdir, job.id)
+        job.append('Компиляция статьи {}'.format(job.name))
+
+        handler = _JobLogHandler(job, asyncio.get_running_loop())
+        handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+
+        def prepare():
+            handler.thread = threading.get_ident()
+            logger.addHandler(handler)
+            try:
+                return self._prepare(job, workspace)
+            finally:
+                logger.removeHandler(handler)
+
+        doc, article = await asyncio.to_thread(prepare)
+
+        jobname = '__preview__'
+        source = doc._part_source('article', doc.first_page,
+                                  os.path.splitext(article.tex_path)[0])
+        cmd = tvim.pdflatex_command(jobname, source, doc.fmt)
+        monitor = doc._pdflatex_monitor(jobname)
+        state = tvim.pdflatex_state(jobname, workspace)
+        for i in range(self.max_passes):
+            job.append('Проход pdflatex {}'.format(i + 1))
+            monitor.start_pass()
+            if not await self._run_pdflatex(job, cmd, workspace, monitor):
+                job.finish('failed', monitor.summary())
+                return
+            new_state = tvim.pdflatex_state(jobname, workspace)
+            if new_state == state:
+                break
+            state = new_state
+
+        job.pdf_path = os.path.join(workspace, jobname + '.pdf')
+        job.pages = await asyncio.to_thread(
+            tvim.typeset_page_count, os.path.join(workspace, jobname))
+        job.append('Статья {} сверстана: страниц {}'.format(job.name,
+                                                            job.pages))
+        job.finish('done')
+
+    @staticmethod
+    async def _run_pdflatex(job, cmd, workspace, monitor):
+        """
+        Проход pdflatex с передачей вывода в журнал задания и монитору
+        (см. tvim.PdflatexMonitor); обреченная сборка останавливается.
+        """
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, cwd=workspace, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            env=dict(os.environ, max_print_line='10000'))
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(proc.stdout.readline(), 1)
+                except asyncio.TimeoutError:
+                    if monitor.stalled():
+                        break
+                    continue
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                job.append(line)
+                if monitor.feed(line):
+                    break
+        finally:
+            if proc.returncode is None and monitor.failure:
+                proc.kill()
+            returncode = await proc.wait()
+        return monitor.finish(returncode)
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > self.max_upload:
+                await self._respond(writer, 413,
+                                    {'error': 'слишком большой архив'})
+                return
+            body = await reader.readexactly(length)
+            await self._route(method, target.split('?', 1)[0], headers,
+                              body, writer)
+        except PermissionError as e:
+            await self._respond(writer, 403, {'error': str(e)})
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await self._respond(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.exception('Ошибка обработки запроса')
+            await self._respond(writer, 500, {'error': str(e)})
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    max_upload = 50 * 1024 * 1024
+
+    async def _route(self, method, target, headers, body, writer):
+        parts = [p for p in target.split('/') if p]
+        if not parts or parts[0] != 'jobs' or len(parts) > 3:
+            await self._respond(writer, 404, {'error': 'not found'})
+            return
+        if len(parts) == 1:
+            if method == 'POST':
+                if headers.get('content-type', '').startswith(
+                        'application/json'):
+                    path = json.loads(body.decode('utf-8')).get('path')
+                    job, created = await self.submit(path=path)
+                else:
+                    job, created = await self.submit(payload=body)
+                await self._respond(writer, 202 if created else 200,
+                                    job.as_dict())
+            elif method == 'GET':
+                self.prune()
+                await self._respond(writer, 200, [
+                    job.as_dict() for job in self.jobs.values()])
+            else:
+                await self._respond(writer, 405, {'error': method})
+            return
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            await self._respond(writer, 404, {'error': 'нет задания'})
+        elif method != 'GET':
+            await self._respond(writer, 405, {'error': method})
+        elif len(parts) == 2:
+            await self._respond(writer, 200, job.as_dict())
+        elif parts[2] == 'log':
+            self._write_head(writer, 200, 'text/plain; charset=utf-8')
+            async for line in job.follow():
+                writer.write(line.encode('utf-8') + b'\n')
+                await writer.drain()
+        elif parts[2] == 'pdf':
+            if job.status != 'done':
+                await self._respond(writer, 409, job.as_dict())
+                return
+            with open(job.pdf_path, 'rb') as f:
+                data = f.read()
+            self._write_head(writer, 200, 'application/pdf', len(data))
+            writer.write(data)
+            await writer.drain()
+        else:
+            await self._respond(writer, 404, {'error': 'not found'})
+
+    @staticmethod
+    def _write_head(writer, status, content_type, length=None):
+        head = ['HTTP/1.1 {} {}'.format(status, HTTP_REASONS[status]),
+                'Content-Type: ' + content_type, 'Connection: close']
+        if length is not None:
+            head.append('Content-Length: {}'.format(length))
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+    async def _respond(self, writer, status, payload):
+        data = json.dumps(payload, ensure_ascii=False, indent=4).encode()
+        self._write_head(writer, status, 'application/json; charset=utf-8',
+                         len(data))
+        writer.write(data)
+        await writer.drain()
+
+
+async def serve(service, host='127.0.0.1', port=8765, unix=None):
+    if service.allow_path and not unix and not is_loopback(host):
+        raise ValueError('Отправка статей по пути (--allow-path) доступна '
+                         'только на локальном адресе или Unix сокете')
+    service.start()
+    if unix:
+        server = await asyncio.start_unix_server(service.handle, unix)
+        print('Сервис сборки ТВИМ: {}'.format(unix))
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        print('Сервис сборки ТВИМ: http://{}:{}/jobs'.format(host, port))
+    async with server:
+        await server.serve_forever()
+
+
+# клиент
+
+@contextlib.asynccontextmanager
+async def request(address, method, target, body=b'', content_type=None):
+    """
+    HTTP запрос к сервису. Контекстный менеджер возвращает код ответа,
+    заголовки и поток для чтения тела ответа; соединение закрывается при
+    выходе из контекста.
+    """
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*address)
+    head = ['{} {} HTTP/1.1'.format(method, target), 'Host: localhost',
+            'Connection: close', 'Content-Length: {}'.format(len(body))]
+    if content_type:
+        head.append('Content-Type: ' + content_type)
+    try:
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1')
+                     + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, value = line.decode('latin-1').split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+        yield status, headers, reader
+    finally:
+        writer.close()
+
+
+def pack_article(path):
+    """
+    Упаковать каталог статьи в zip архив (служебные файлы `__*` и скрытые
+    файлы пропускаются).
+    """
+    data = io.BytesIO()
+    base = os.path.dirname(os.path.normpath(path))
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                if name.startswith(('__', '.')):
+                    continue
+                file_path = os.path.join(root, name)
+                archive.write(file_path, os.path.relpath(file_path, base))
+    return data.getvalue()
+
+
+async def submit(address, path, output=None, local=False):
+    """
+    Отправить статью, вывести журнал сборки и сохранить PDF файл.
+
+    Returns
+    -------
+        bool
+            True, если статья сверстана
+    """
+    if local:
+        body = json.dumps({'path': os.path.abspath(path)}).encode()
+        content_type = 'application/json'
+    elif os.path.isdir(path):
+        body, content_type = pack_article(path), 'application/zip'
+    else:
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = 'application/octet-stream'
+    async with request(address, 'POST', '/jobs', body,
+                       content_type) as (status, _, reader):
+        job = json.loads(await reader.read())
+    if status not in (200, 202):
+        print('ОШИБКА: {}'.format(job.get('error')))
+        return False
+    if status == 200:
+        print('Статья с таким содержимым уже отправлена, '
+              'задание {}'.format(job['id']))
+
+    async with request(address, 'GET', '/jobs/{}/log'.format(
+            job['id'])) as (_, _, reader):
+        async for line in reader:
+            sys.stdout.write(line.decode('utf-8', 'replace'))
+
+    async with request(address, 'GET', '/jobs/{}/pdf'.format(
+            job['id'])) as (status, _, reader):
+        data = await reader.read()
+    if status != 200:
+        print('ОШИБКА: статья не сверстана')
+        return False
+    output = output or '{}.pdf'.format(job['name'])
+    with open(output, 'wb') as f:
+        f.write(data)
+    print('PDF файл сохранен в {}'.format(output))
+    return True
+
+
+if __name__ == '__main__':
+    address_parser = argparse.ArgumentParser(add_help=False)
+    address_parser.add_argument('--host', type=str, default='127.0.0.1')
+    address_parser.add_argument('--port', type=int, default=8765)
+    address_parser.add_argument('--unix', type=str, default=None,
+                                help='Unix socket path instead of TCP')
+
+    parser = argparse.ArgumentParser(description='TVIM build service')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', parents=[address_parser],
+                                         help='run the service')
+    serve_parser.add_argument('--config', '-C', type=str,
+                              default='configs/config.yaml',
+                              help='issue config (resources and parameters)')
+    serve_parser.add_argument('--workers', '-j', type=int, default=2,
+                              help='number of jobs built at once')
+    serve_parser.add_argument('--workdir', type=str,
+                              default=os.path.join('numbers', '.service'),
+                              help='directory for job workspaces')
+    serve_parser.add_argument('--max-passes', type=int, default=3,
+                              help='maximum number of pdflatex passes')
+    serve_parser.add_argument('--no-format', action='store_true',
+                              help='do not use the cached preamble format')
+    serve_parser.add_argument('--no-figures', action='store_true',
+                              help='do not convert EPS figures and downsample '
+                                   'large raster figures')
+    serve_parser.add_argument('--allow-path', type=str, default=None,
+                              metavar='ROOT',
+                              help='accept article directories sent by path '
+                                   '(submit --local) if they are inside ROOT; '
+                                   'loopback host or Unix socket only')
+    serve_parser.add_argument('--max-jobs', type=int, default=100,
+                              help='number of finished jobs kept')
+    serve_parser.add_argument('--job-ttl', type=float, default=24 * 3600,
+                              help='seconds a finished job and its workspace '
+                                   'are kept')
+
+    submit_parser = subparsers.add_parser(
+        'submit', parents=[address_parser],
+        help='submit an article directory or archive')
+    submit_parser.add_argument('path', type=str)
+    submit_parser.add_argument('--output', '-O', type=str, default=None,
+                               help='preview PDF path (default: <name>.pdf)')
+    submit_parser.add_argument('--local', action='store_true',
+                               help='send the directory path instead of an '
+                                    'archive (service on the same machine)')
+    args = parser.parse_args()
+
+    address = args.unix or (args.host, args.port)
+    if args.command == 'serve':
+        if args.allow_path and not args.unix and not is_loopback(args.host):
+            parser.error('--allow-path requires a loopback --host or --unix')
+        import yaml
+        with open(args.config, 'rt') as config_file:
+            config = yaml.load(config_file, Loader=yaml.SafeLoader)
+        service = BuildService(config, args.workdir, workers=args.workers,
+                               max_passes=args.max_passes,
+                               use_format=not args.no_format,
+                               use_figures=not args.no_figures,
+                               allow_path=args.allow_path,
+                               max_jobs=args.max_jobs,
+                               job_ttl=args.job_ttl)
+        try:
+            asyncio.run(serve(service, args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            print('Сервис остановлен')
+    else:
+        sys.exit(0 if asyncio.run(submit(address, args.path, args.output,
+                                         args.local)) else 1)